@@ -1,12 +1,158 @@
 from django.contrib import admin
-from .models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, Contact
-
-admin.site.register(Shop)
-admin.site.register(Category)
-admin.site.register(Product)
-admin.site.register(ProductInfo)
-admin.site.register(Parameter)
-admin.site.register(ProductParameter)
-admin.site.register(Order)
-admin.site.register(OrderItem)
-admin.site.register(Contact)
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import (Shop, ShopShard, Category, CategoryShop, Product, ProductInfo, ProductOfferSummary, Parameter, ProductParameter,
+                     Order, OrderItem, ShopOrder, Contact, CatalogChange)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for huge tables.
+
+    An unfiltered changelist on PostgreSQL takes the row count from the
+    planner statistics (``pg_class.reltuples``) instead of ``COUNT(*)`` once
+    the table is estimated to hold more than ``threshold`` rows.
+    """
+    threshold = 100_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > self.threshold:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Shop)
+class ShopAdmin(admin.ModelAdmin):
+    list_display = ('name', 'url', 'user', 'state')
+    list_select_related = ('user',)
+    list_filter = ('state',)
+    search_fields = ('^name',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(ShopShard)
+class ShopShardAdmin(admin.ModelAdmin):
+    list_display = ('shop', 'database')
+    list_select_related = ('shop',)
+    list_filter = ('database',)
+    autocomplete_fields = ('shop',)
+
+
+class CategoryShopInline(admin.TabularInline):
+    model = CategoryShop
+    autocomplete_fields = ('shop',)
+    readonly_fields = ('offer_count',)
+    extra = 0
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    search_fields = ('^name',)
+    inlines = (CategoryShopInline,)
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('name', 'category')
+    list_select_related = ('category',)
+    search_fields = ('^name',)
+    autocomplete_fields = ('category',)
+
+
+@admin.register(ProductInfo)
+class ProductInfoAdmin(LargeTableAdmin):
+    list_display = ('id', 'product', 'shop', 'external_id', 'model', 'quantity', 'price', 'price_rrc')
+    list_select_related = ('product', 'shop')
+    list_filter = ('shop',)
+    search_fields = ('=id', '=external_id')
+    raw_id_fields = ('product',)
+    autocomplete_fields = ('shop',)
+
+
+@admin.register(ProductOfferSummary)
+class ProductOfferSummaryAdmin(LargeTableAdmin):
+    list_display = ('product', 'min_price', 'shop', 'offer_count', 'total_quantity', 'updated')
+    list_select_related = ('product', 'shop')
+    search_fields = ('=product__id',)
+    raw_id_fields = ('product',)
+    autocomplete_fields = ('shop',)
+
+
+@admin.register(Parameter)
+class ParameterAdmin(admin.ModelAdmin):
+    search_fields = ('^name',)
+
+
+@admin.register(ProductParameter)
+class ProductParameterAdmin(LargeTableAdmin):
+    list_display = ('id', 'product_info', 'parameter', 'value')
+    list_select_related = ('product_info__product', 'product_info__shop', 'parameter')
+    search_fields = ('=id', '=product_info__id')
+    raw_id_fields = ('product_info',)
+    autocomplete_fields = ('parameter',)
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    raw_id_fields = ('product_info',)
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('order', 'product_info__product', 'product_info__shop')
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'dt', 'state')
+    list_select_related = ('user',)
+    list_filter = ('state',)
+    search_fields = ('=id', '=user__username')
+    raw_id_fields = ('user',)
+    inlines = (OrderItemInline,)
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ('id', 'order', 'product_info', 'quantity')
+    list_select_related = ('order', 'product_info__product', 'product_info__shop')
+    search_fields = ('=id', '=order__id')
+    raw_id_fields = ('order', 'product_info')
+
+
+@admin.register(ShopOrder)
+class ShopOrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'order', 'shop', 'state', 'item_count', 'subtotal', 'created')
+    list_select_related = ('order', 'shop')
+    list_filter = ('state', 'shop')
+    search_fields = ('=id', '=order__id')
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('shop',)
+
+
+@admin.register(Contact)
+class ContactAdmin(admin.ModelAdmin):
+    list_display = ('user', 'city', 'street', 'house', 'phone')
+    list_select_related = ('user',)
+    search_fields = ('=user__username', '^phone')
+    raw_id_fields = ('user',)
+
+
+@admin.register(CatalogChange)
+class CatalogChangeAdmin(LargeTableAdmin):
+    list_display = ('id', 'model', 'object_id', 'action', 'created')
+    list_filter = ('action',)
+    search_fields = ('=object_id',)
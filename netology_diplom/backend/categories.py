@@ -0,0 +1,86 @@
+"""
+Shop membership of categories.
+
+``Category.shops`` is derived from the shops' offers: after an import,
+``sync_shop_categories`` counts the shop's offers per category with one
+grouped query and writes only the rows that changed, one upsert for new and
+recounted categories and one delete for categories the shop no longer
+sells in.
+
+``categories/?shop=<id>`` is served from a per-shop list of categories with
+offer counts, precomputed into the cache when the shop's import commits. The
+lists expire after ``SHOP_CATEGORIES_TTL`` seconds, which bounds how long a
+worker with a per-process cache serves a list older than the last import.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .changes import record_change
+from .models import Shop, Category, CategoryShop, ProductInfo
+from .sharding import shard_for_shop, replicate_category_shops
+
+SHOP_CATEGORIES_TTL = 300
+
+
+def shop_categories_key(shop_id):
+    return f'shop-categories:{shop_id}'
+
+
+def sync_shop_categories(shop):
+    """Bring the shop's category memberships and offer counts in line with its offers."""
+    counts = dict(ProductInfo.objects.using(shard_for_shop(shop.id))
+                  .filter(shop=shop)
+                  .order_by()
+                  .values_list('product__category_id')
+                  .annotate(offer_count=Count('id')))
+    existing = dict(CategoryShop.objects.filter(shop=shop).values_list('category_id', 'offer_count'))
+
+    changed = [CategoryShop(category_id=category_id, shop=shop, offer_count=offer_count)
+               for category_id, offer_count in counts.items() if existing.get(category_id) != offer_count]
+    stale = existing.keys() - counts.keys()
+    CategoryShop.objects.bulk_create(changed, update_conflicts=True,
+                                     unique_fields=['category', 'shop'], update_fields=['offer_count'])
+    if stale:
+        CategoryShop.objects.filter(shop=shop, category_id__in=stale).delete()
+
+    # The change feed carries category memberships, not counts.
+    for category in Category.objects.filter(pk__in=(counts.keys() - existing.keys()) | stale):
+        record_change(category, 'upsert')
+    if settings.PRODUCT_SHARDS and (changed or stale):
+        replicate_category_shops({link.category_id for link in changed} | stale)
+
+    transaction.on_commit(partial(publish_shop_categories, shop.id))
+
+
+def build_shop_categories(shop_id):
+    return [{'id': category_id, 'name': name, 'offer_count': offer_count}
+            for category_id, name, offer_count in (CategoryShop.objects
+                                                    .filter(shop_id=shop_id)
+                                                    .order_by('-category__name')
+                                                    .values_list('category_id', 'category__name', 'offer_count'))]
+
+
+def publish_shop_categories(shop_id):
+    cache.set(shop_categories_key(shop_id), build_shop_categories(shop_id), SHOP_CATEGORIES_TTL)
+
+
+def shop_categories(shop_id):
+    """
+    The shop's categories with offer counts, as of its last committed import,
+    or ``None`` if there is no such shop.
+
+    A cache miss is filled with ``add`` so it can never overwrite the list an
+    import has just published. Unknown shops are not cached.
+    """
+    key = shop_categories_key(shop_id)
+    categories = cache.get(key)
+    if categories is None:
+        if not Shop.objects.filter(pk=shop_id).exists():
+            return None
+        categories = build_shop_categories(shop_id)
+        cache.add(key, categories, SHOP_CATEGORIES_TTL)
+    return categories
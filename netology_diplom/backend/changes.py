@@ -0,0 +1,90 @@
+"""
+Catalog change feed.
+
+Every write to a tracked catalog model appends a sequence-numbered
+``CatalogChange`` row in the writer's transaction. Consumers read the rows
+after their last seen id. Ids are only handed out while holding a
+transaction-scoped advisory lock on PostgreSQL, so rows become visible in id
+order and a consumer can never skip over a row that commits late.
+
+Bulk writers (the catalog import) wrap their work in ``deferred_changes``:
+changes are collapsed to the last action per object and written with a single
+``bulk_create`` right before the transaction commits.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Shop, Category, Product, ProductInfo, ProductParameter, CatalogChange
+
+TRACKED_MODELS = (Shop, Category, Product, ProductInfo, ProductParameter)
+
+FEED_LOCK_ID = 0x636174616c6f67  # "catalog"
+
+_deferred = threading.local()
+
+
+def serialize_instance(instance):
+    data = {field.attname: field.value_from_object(instance) for field in instance._meta.concrete_fields}
+    if isinstance(instance, Category):
+        data['shops'] = sorted(instance.shops.values_list('id', flat=True))
+    return data
+
+
+def build_change(instance, action, object_id):
+    return CatalogChange(model=instance._meta.model_name,
+                         object_id=object_id,
+                         action=action,
+                         data=serialize_instance(instance) if action == 'upsert' else None)
+
+
+def write_changes(changes):
+    if not changes:
+        return
+    # The lock is held until the surrounding transaction commits.
+    with transaction.atomic(savepoint=False):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [FEED_LOCK_ID])
+        CatalogChange.objects.bulk_create(changes, batch_size=1000)
+
+
+def record_change(instance, action):
+    """Append a change now, or collapse it into the pending batch."""
+    pending = getattr(_deferred, 'changes', None)
+    if pending is None:
+        write_changes([build_change(instance, action, instance.pk)])
+        return
+    key = (instance._meta.model_name, instance.pk)
+    pending.pop(key, None)
+    pending[key] = (instance, action)
+
+
+@contextmanager
+def deferred_changes():
+    """Collect changes inside the block and write them in one batch on exit."""
+    if getattr(_deferred, 'changes', None) is not None:
+        yield
+        return
+    _deferred.changes = {}
+    try:
+        yield
+        pending = _deferred.changes
+    finally:
+        _deferred.changes = None
+    write_changes([build_change(instance, action, object_id)
+                   for (_, object_id), (instance, action) in pending.items()])
+
+
+def compact_changes(upto=None):
+    """Drop every change superseded by a later change to the same object."""
+    newer = CatalogChange.objects.filter(model=OuterRef('model'),
+                                         object_id=OuterRef('object_id'),
+                                         id__gt=OuterRef('id'))
+    superseded = CatalogChange.objects.filter(Exists(newer))
+    if upto is not None:
+        superseded = superseded.filter(id__lte=upto)
+    deleted, _ = superseded.delete()
+    return deleted
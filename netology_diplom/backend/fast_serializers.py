@@ -0,0 +1,89 @@
+"""
+values()-based list serialization.
+
+These functions produce exactly what ``ProductInfoSerializer(many=True)`` and
+``OrderSerializer(many=True)`` produce, but read ``.values()`` rows instead of
+model instances and skip per-field serializer dispatch. Field formatting
+(decimals, datetimes) is delegated to the field objects of the regular
+serializers, so both paths stay in sync when those fields change.
+"""
+from collections import defaultdict
+from functools import cache
+
+from .models import Category, OrderItem
+from .serializers import ProductInfoSerializer, OrderSerializer
+from .sharding import product_info_values
+
+
+@cache
+def _product_info_fields():
+    fields = ProductInfoSerializer().fields
+    return fields['price'].to_representation, fields['price_rrc'].to_representation
+
+
+@cache
+def _order_fields():
+    return OrderSerializer().fields['dt'].to_representation
+
+
+def _category_shops(category_ids):
+    shops = defaultdict(list)
+    memberships = (Category.shops.through.objects
+                   .filter(category_id__in=category_ids)
+                   .order_by('-shop__name')  # Shop.Meta.ordering, as category.shops.all() returns them
+                   .values_list('category_id', 'shop_id'))
+    for category_id, shop_id in memberships:
+        shops[category_id].append(shop_id)
+    return shops
+
+
+def serialize_product_infos(queryset):
+    price, price_rrc = _product_info_fields()
+    rows = list(queryset.values('id', 'quantity', 'price', 'price_rrc',
+                                'product_id', 'product__name',
+                                'product__category_id', 'product__category__name',
+                                'shop_id', 'shop__name', 'shop__url'))
+    category_shops = _category_shops({row['product__category_id'] for row in rows})
+    return [{
+        'id': row['id'],
+        'product': {
+            'id': row['product_id'],
+            'name': row['product__name'],
+            'category': {
+                'id': row['product__category_id'],
+                'name': row['product__category__name'],
+                'shops': category_shops.get(row['product__category_id'], []),
+            },
+        },
+        'shop': {
+            'id': row['shop_id'],
+            'name': row['shop__name'],
+            'url': row['shop__url'],
+        },
+        'quantity': row['quantity'],
+        'price': price(row['price']),
+        'price_rrc': price_rrc(row['price_rrc']),
+    } for row in rows]
+
+
+def serialize_orders(queryset):
+    dt = _order_fields()
+    orders = list(queryset.values('id', 'user_id', 'dt', 'state'))
+    items = defaultdict(list)
+    totals = defaultdict(int)
+    order_items = list(OrderItem.objects
+                       .filter(order_id__in=[order['id'] for order in orders])
+                       .order_by('id')
+                       .values_list('id', 'order_id', 'product_info_id', 'quantity'))
+    prices = dict(product_info_values({item[2] for item in order_items}, 'id', 'price'))
+    for item_id, order_id, product_info_id, quantity in order_items:
+        items[order_id].append({'id': item_id, 'product_info': product_info_id, 'quantity': quantity})
+        totals[order_id] += quantity * prices[product_info_id]
+    return [{
+        'id': order['id'],
+        'user': order['user_id'],
+        'dt': dt(order['dt']),
+        'state': order['state'],
+        'ordered_items': items[order['id']],
+        'total_sum': totals[order['id']],
+    } for order in orders]
@@ -0,0 +1,59 @@
+"""
+Per-shop fulfillment of orders.
+
+At checkout an order is split into one ``ShopOrder`` per shop with the item
+count and subtotal of that shop's items. Partners work on their sub-orders
+only; the parent ``Order.state`` is derived from them. A sub-order only moves
+forward along ``STATE_PROGRESS`` and can be canceled until it is sent.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Order, OrderItem, ShopOrder
+from .sharding import product_info_values
+
+STATE_PROGRESS = ('new', 'confirmed', 'assembled', 'sent', 'delivered')
+
+
+def can_change_state(current, state):
+    if current not in STATE_PROGRESS:
+        return False
+    if state == 'canceled':
+        return STATE_PROGRESS.index(current) < STATE_PROGRESS.index('sent')
+    return STATE_PROGRESS.index(state) > STATE_PROGRESS.index(current)
+
+
+def derive_order_state(states):
+    """The least advanced state of the sub-orders that were not canceled."""
+    active = [state for state in states if state != 'canceled']
+    if not active:
+        return 'canceled'
+    return min(active, key=STATE_PROGRESS.index)
+
+
+def create_shop_orders(order):
+    items = OrderItem.objects.filter(order=order).values_list('product_info_id', 'quantity')
+    quantities = dict(items)
+    per_shop = defaultdict(lambda: {'item_count': 0, 'subtotal': 0})
+    for product_info_id, shop_id, price in product_info_values(quantities, 'id', 'shop_id', 'price'):
+        per_shop[shop_id]['item_count'] += 1
+        per_shop[shop_id]['subtotal'] += quantities[product_info_id] * price
+    return ShopOrder.objects.bulk_create([
+        ShopOrder(order=order, shop_id=shop_id, state=order.state, **totals)
+        for shop_id, totals in sorted(per_shop.items())
+    ])
+
+
+@transaction.atomic
+def set_shop_order_state(shop_order, state):
+    order = Order.objects.select_for_update().get(pk=shop_order.order_id)
+    current = ShopOrder.objects.values_list('state', flat=True).get(pk=shop_order.pk)
+    if not can_change_state(current, state):
+        raise ValidationError({'state': [f"Cannot change state from '{current}' to '{state}'"]})
+    shop_order.state = state
+    shop_order.save(update_fields=['state'])
+    order.state = derive_order_state(order.shop_orders.values_list('state', flat=True))
+    order.save(update_fields=['state'])
+    return order
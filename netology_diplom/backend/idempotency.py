@@ -0,0 +1,110 @@
+"""
+``Idempotency-Key`` support for mutating endpoints.
+
+The first request with a given key claims it by inserting an
+``IdempotencyKey`` row (committed on its own, before the handler runs). When
+the handler finishes, its response is stored on the row and replayed to every
+retry with the same key until the row expires; retries never reach the
+handler. A retry that arrives while the first request is still running waits
+for it to finish. Server errors release the key so the request can be retried.
+
+A claim is a lease: if its request has not finished ``IDEMPOTENCY_LEASE``
+after it was claimed (its worker died), the next retry takes the key over and
+runs the handler. The original request, should it still finish, then neither
+stores its response nor releases the key.
+"""
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+WAIT_TIMEOUT = 10
+POLL_INTERVAL = 0.1
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim_key(user, key, fingerprint):
+    """Return ``(record, None)`` if this request owns the key, else ``(None, response)``."""
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(user=user, key=key, request_hash=fingerprint, claimed=now,
+                                                       expires=now + settings.IDEMPOTENCY_KEY_TTL)
+            return record, None
+        except IntegrityError:
+            pass
+
+        existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if existing is None:
+            continue
+        if existing.expires <= now:
+            IdempotencyKey.objects.filter(pk=existing.pk, expires__lte=now).delete()
+            continue
+        if existing.request_hash != fingerprint:
+            return None, Response({'Status': False, 'Error': f'{HEADER} was already used for a different request'},
+                                  status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if existing.response_status is not None:
+            return None, Response(existing.response_body, status=existing.response_status,
+                                  headers={'Idempotent-Replayed': 'true'})
+        if existing.claimed <= now - settings.IDEMPOTENCY_LEASE:
+            if IdempotencyKey.objects.filter(pk=existing.pk, claimed=existing.claimed,
+                                             response_status__isnull=True).update(claimed=now):
+                existing.claimed = now
+                return existing, None
+            continue
+        if time.monotonic() >= deadline:
+            return None, Response({'Status': False, 'Error': 'A request with this key is still in progress'},
+                                  status=status.HTTP_409_CONFLICT)
+        time.sleep(POLL_INTERVAL)
+
+
+def idempotent(handler):
+    """Make a DRF view handler replay its response for repeated ``Idempotency-Key``s."""
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response({'Status': False, 'Error': f'{HEADER} is too long'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        record, response = claim_key(request.user, key, request_fingerprint(request))
+        if response is not None:
+            return response
+
+        # Only touch the key while this request still holds its lease.
+        claim = IdempotencyKey.objects.filter(pk=record.pk, claimed=record.claimed)
+        try:
+            response = handler(self, request, *args, **kwargs)
+        except Exception:
+            claim.delete()
+            raise
+        if response.status_code >= 500:
+            claim.delete()
+        else:
+            # Round-trip through DRF's encoder so the replay renders exactly like the original.
+            claim.update(response_status=response.status_code,
+                         response_body=json.loads(json.dumps(response.data, cls=JSONEncoder)))
+        return response
+    return wrapper
@@ -0,0 +1,144 @@
+"""
+Partner price-list import.
+
+The price list is the YAML document partners publish at their URL::
+
+    shop: Shop name
+    categories:
+      - {id: 224, name: Smartphones}
+    goods:
+      - {id: 4216292, category: 224, model: apple/iphone/xs-max, name: ...,
+         price: 110000, price_rrc: 116990, quantity: 14,
+         parameters: {"Screen size": 6.5, ...}}
+"""
+from functools import partial
+from urllib.request import urlopen
+
+import yaml
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import IntegrityError, transaction
+
+from .models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, OrderItem
+from .offers import deferred_offer_refresh, offers_changed
+from .changes import deferred_changes, record_change
+from .categories import sync_shop_categories
+from .sharding import shard_for_shop
+from .snapshots import publish_snapshots
+
+FETCH_TIMEOUT = 30
+
+BATCH_SIZE = 1000
+
+OFFER_FIELDS = ['external_id', 'name', 'model', 'price', 'price_rrc', 'quantity']
+
+
+def fetch_price_list(url):
+    try:
+        with urlopen(url, timeout=FETCH_TIMEOUT) as response:
+            return yaml.safe_load(response.read())
+    except (OSError, yaml.YAMLError) as exc:
+        raise ValidationError(f"Could not load price list: {exc}")
+
+
+@transaction.atomic
+def import_shop_catalog(user, url, data):
+    """
+    Bring the shop's offers in line with a parsed price list.
+
+    Offers are matched by product and updated in place, so their ids (and the
+    order items pointing at them) survive re-imports. Offers missing from the
+    price list are deleted, or kept with quantity 0 while orders reference
+    them. The shop's category memberships are derived from the new offers;
+    its category list and catalog snapshot are republished once the import
+    commits; the aggregate snapshot is only marked stale.
+    """
+    # Every change, the new shop's included, goes into the batch written just before commit, so the
+    # change feed's advisory lock is not held for the whole import.
+    with deferred_changes():
+        try:
+            with transaction.atomic():
+                shop, _ = Shop.objects.get_or_create(name=data['shop'], defaults={'url': url, 'user': user})
+        except IntegrityError:
+            raise ValidationError("Another shop is already registered with this URL")
+        if shop.user_id != user.id:
+            raise PermissionDenied("The shop belongs to another user")
+
+        shard = shard_for_shop(shop.id, cached=False)
+        with transaction.atomic(using=shard), deferred_offer_refresh():
+            for category in data.get('categories', []):
+                Category.objects.get_or_create(id=category['id'], defaults={'name': category['name']})
+
+            items = {}
+            for item in data.get('goods', []):
+                product, _ = Product.objects.get_or_create(name=item['name'],
+                                                           defaults={'category_id': item['category']})
+                items[product.id] = item
+            offers = upsert_offers(shop, shard, items)
+            upsert_parameters(shard, {offers[product_id].id: item.get('parameters', {})
+                                      for product_id, item in items.items()})
+            sync_shop_categories(shop)
+
+    transaction.on_commit(partial(publish_snapshots, shop.id), robust=True)
+    return shop
+
+
+def upsert_offers(shop, shard, items):
+    """Create, update and retire the shop's offers; ``items`` maps product ids to price-list goods."""
+    existing = {offer.product_id: offer for offer in ProductInfo.objects.using(shard).filter(shop=shop)}
+    offers, to_create, to_update = {}, [], []
+    for product_id, item in items.items():
+        values = {field: ProductInfo._meta.get_field(field).to_python(value) for field, value in (
+            ('external_id', item['id']), ('name', item['name']), ('model', item.get('model', '')),
+            ('price', item['price']), ('price_rrc', item['price_rrc']), ('quantity', item['quantity']))}
+        offer = existing.pop(product_id, None)
+        if offer is None:
+            offer = ProductInfo(product_id=product_id, shop=shop, **values)
+            to_create.append(offer)
+        elif any(getattr(offer, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(offer, field, value)
+            to_update.append(offer)
+        offers[product_id] = offer
+
+    # Offers dropped from the price list stay while orders point at them.
+    ordered = set(OrderItem.objects.filter(product_info_id__in=[offer.id for offer in existing.values()])
+                  .values_list('product_info_id', flat=True))
+    for offer in existing.values():
+        if offer.id in ordered and offer.quantity:
+            offer.quantity = 0
+            to_update.append(offer)
+
+    ProductInfo.objects.using(shard).bulk_create(to_create, batch_size=BATCH_SIZE)
+    ProductInfo.objects.using(shard).bulk_update(to_update, OFFER_FIELDS, batch_size=BATCH_SIZE)
+    ProductInfo.objects.using(shard).filter(id__in=[offer.id for offer in existing.values()
+                                                    if offer.id not in ordered]).delete()
+
+    for offer in to_create + to_update:
+        record_change(offer, 'upsert')
+    offers_changed(offer.product_id for offer in to_create + to_update)
+    return offers
+
+
+def upsert_parameters(shard, parameters):
+    """Write ``{offer id: {name: value}}``, touching only parameters that changed."""
+    names = {name for values in parameters.values() for name in values}
+    parameter_ids = {name: Parameter.objects.get_or_create(name=name)[0].id for name in names}
+    existing = {(row.product_info_id, row.parameter_id): row for row in
+                ProductParameter.objects.using(shard).filter(product_info_id__in=parameters)}
+
+    to_create, to_update = [], []
+    for product_info_id, values in parameters.items():
+        for name, value in values.items():
+            row = existing.pop((product_info_id, parameter_ids[name]), None)
+            if row is None:
+                to_create.append(ProductParameter(product_info_id=product_info_id,
+                                                  parameter_id=parameter_ids[name], value=str(value)))
+            elif row.value != str(value):
+                row.value = str(value)
+                to_update.append(row)
+
+    ProductParameter.objects.using(shard).bulk_create(to_create, batch_size=BATCH_SIZE)
+    ProductParameter.objects.using(shard).bulk_update(to_update, ['value'], batch_size=BATCH_SIZE)
+    ProductParameter.objects.using(shard).filter(id__in=[row.id for row in existing.values()]).delete()
+    for row in to_create + to_update:
+        record_change(row, 'upsert')
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from backend.models import ProductInfo
+from backend.resharding import copy_reference_data, move_shop_offers
+from backend.sharding import shard_for_shop
+
+
+class Command(BaseCommand):
+    help = ("Copy the reference tables from default to every shard and move offers stored on default "
+            "to their shops' shards. Run after migrating new shards; safe to re-run.")
+
+    def handle(self, *args, **options):
+        if not settings.PRODUCT_SHARDS:
+            raise CommandError('PRODUCT_SHARDS is not set')
+
+        copy_reference_data()
+        shop_ids = (ProductInfo.objects.using(DEFAULT_DB_ALIAS)
+                    .order_by('shop_id').values_list('shop_id', flat=True).distinct())
+        total = 0
+        for shop_id in list(shop_ids):
+            total += move_shop_offers(shop_id, shard_for_shop(shop_id, cached=False))
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied reference data to {', '.join(settings.PRODUCT_SHARDS)}, moved {total} offers from default"))
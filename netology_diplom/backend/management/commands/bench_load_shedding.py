@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils.module_loading import import_string
+
+from backend.middleware import WORKERS_KEY, LoadSheddingMiddleware
+from backend.throttling import ScopedBucketThrottle
+
+KEY_PREFIX = 'bench-load-shedding'
+
+
+class CatalogView:
+    throttle_scope = 'catalog'
+
+
+def bench_cache():
+    """A client of the configured cache backend whose keys cannot collide with the application's."""
+    params = dict(settings.CACHES['default'])
+    backend = import_string(params.pop('BACKEND'))
+    location = params.pop('LOCATION', KEY_PREFIX)
+    return backend(location, dict(params, KEY_PREFIX=KEY_PREFIX))
+
+
+class Command(BaseCommand):
+    help = ('Measure the per-request overhead of LoadSheddingMiddleware and ScopedBucketThrottle '
+            'on the configured cache backend, under keys of their own')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100_000, help='Calls per measurement')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        backend = settings.CACHES['default']['BACKEND']
+        cache = bench_cache()
+        request = RequestFactory().get('/api/v1/product-info/')
+        request.user = AnonymousUser()
+        response = HttpResponse()
+
+        def get_response(request):
+            return response
+
+        middleware = LoadSheddingMiddleware(get_response)
+        middleware.cache = cache
+        bare = self.measure(lambda: get_response(request), count)
+        shedding = self.measure(lambda: middleware(request), count)
+        self.stdout.write(f'LoadSheddingMiddleware ({backend}): {(shedding - bare) / count * 1e6:.2f} µs per request')
+        cache.delete_many([WORKERS_KEY, middleware.key])
+
+        throttle = ScopedBucketThrottle()
+        throttle.cache = cache
+        view = CatalogView()
+        throttled = self.measure(lambda: throttle.allow_request(request, view), count)
+        self.stdout.write(f'ScopedBucketThrottle ({backend}): {throttled / count * 1e6:.2f} µs per request')
+
+    def measure(self, func, count):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        return time.perf_counter() - start
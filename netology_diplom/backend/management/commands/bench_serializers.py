@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.fast_serializers import serialize_product_infos, serialize_orders
+from backend.renderers import ORJSONRenderer
+from backend.serializers import ProductInfoSerializer, OrderSerializer
+from backend.views import ProductInfoViewSet, OrderViewSet
+from rest_framework.renderers import JSONRenderer
+
+
+class Command(BaseCommand):
+    help = ('Compare regular and values()-based list serialization of product-info/ and orders/ '
+            'on the current database; fails if the rendered JSON differs')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per list')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per variant, the best one is reported')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        cases = [
+            ('product-info', ProductInfoViewSet.queryset,
+             lambda qs: ProductInfoSerializer(qs, many=True).data, serialize_product_infos),
+            ('orders', OrderViewSet.with_items(OrderViewSet.queryset),
+             lambda qs: OrderSerializer(qs, many=True).data, serialize_orders),
+        ]
+        for name, queryset, serialize, fast_serialize in cases:
+            ids = list(queryset.values_list('pk', flat=True)[:rows])
+            page = queryset.filter(pk__in=ids)
+
+            regular, regular_time = self.measure(lambda: JSONRenderer().render(serialize(page.all())), repeat)
+            fast, fast_time = self.measure(lambda: ORJSONRenderer().render(fast_serialize(page.all())), repeat)
+            if regular != fast:
+                raise CommandError(f'{name}: fast serialization output differs from the serializer')
+
+            self.stdout.write(f'{name}: {len(ids)} rows, {len(regular)} bytes, '
+                              f'serializer {regular_time * 1000:.1f} ms, '
+                              f'values()+orjson {fast_time * 1000:.1f} ms, '
+                              f'x{regular_time / fast_time if fast_time else 0:.1f}')
+
+    def measure(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from backend.changes import compact_changes
+
+
+class Command(BaseCommand):
+    help = 'Remove catalog changes superseded by a later change to the same object'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--upto', type=int, help='Only compact changes with id up to this value')
+
+    def handle(self, *args, **options):
+        deleted = compact_changes(upto=options['upto'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {deleted} superseded changes'))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.models import Shop
+from backend.resharding import move_shop_offers
+
+
+class Command(BaseCommand):
+    help = ("Move a shop's offers to another shard. Offers get ids from the target shard's range and "
+            "order items are re-pointed to them. Safe to re-run if interrupted: offers left on other "
+            "databases are cleaned up even when the shop is already pinned to the target.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_id', type=int)
+        parser.add_argument('database', help='Target database alias from PRODUCT_SHARDS')
+
+    def handle(self, *args, **options):
+        shop_id, target = options['shop_id'], options['database']
+        if target not in settings.PRODUCT_SHARDS:
+            raise CommandError(f'{target} is not listed in PRODUCT_SHARDS')
+        if not Shop.objects.filter(pk=shop_id).exists():
+            raise CommandError(f'Shop {shop_id} does not exist')
+
+        moved = move_shop_offers(shop_id, target)
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} offers of shop {shop_id} to {target}'))
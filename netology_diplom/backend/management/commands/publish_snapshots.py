@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Shop
+from backend.snapshots import publish_shop_snapshot, publish_aggregate_snapshot, publish_stale_aggregate
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the catalog snapshots of the given active shops (all by default) and the aggregate '
+            'snapshot. With --stale, only rebuild the aggregate if a change marked it stale (run it periodically).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_ids', nargs='*', type=int, help='Only rebuild these shops')
+        parser.add_argument('--stale', action='store_true', help='Only rebuild a stale aggregate snapshot')
+
+    def handle(self, *args, **options):
+        if options['stale']:
+            manifest = publish_stale_aggregate()
+            if manifest is None:
+                self.stdout.write('The aggregate snapshot is up to date')
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Published the aggregate snapshot, {manifest['json']['offers']} offers"))
+            return
+
+        shops = Shop.objects.filter(state=True).order_by('id').values_list('id', flat=True)
+        if options['shop_ids']:
+            shops = shops.filter(id__in=options['shop_ids'])
+        total = 0
+        for shop_id in shops:
+            publish_shop_snapshot(shop_id)
+            total += 1
+        manifest = publish_aggregate_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"Published {total} shop snapshots, {manifest['json']['offers']} offers in the aggregate"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Product
+from backend.offers import BATCH_SIZE, refresh_offer_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the best-offer summary of every product'
+
+    def handle(self, *args, **options):
+        product_ids = Product.objects.order_by('id').values_list('id', flat=True)
+        batch = []
+        total = 0
+        for product_id in product_ids.iterator(chunk_size=BATCH_SIZE):
+            batch.append(product_id)
+            if len(batch) == BATCH_SIZE:
+                refresh_offer_summaries(batch)
+                total += len(batch)
+                batch = []
+        refresh_offer_summaries(batch)
+        total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {total} product summaries'))
@@ -0,0 +1,97 @@
+import os
+import socket
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.middleware.gzip import GZipMiddleware
+
+WORKERS_KEY = 'load-shedding:workers'
+# A worker's published count disappears this long after its last request, e.g. when the worker died.
+WORKER_TTL = 60
+
+
+def release_slot(request):
+    """Stop counting ``request`` as in flight, e.g. before its view waits without using the database."""
+    request = getattr(request, '_request', request)
+    release = getattr(request, '_load_shedding_release', None)
+    if release is not None:
+        request._load_shedding_release = None
+        release()
+
+
+class LoadSheddingMiddleware:
+    """
+    Reject requests with 503 and ``Retry-After`` once too many database-bound
+    requests are in flight across all workers.
+
+    Only paths starting with one of ``LOAD_SHEDDING_PATHS`` count. The limit is
+    ``LOAD_SHEDDING_MAX_IN_FLIGHT``; 0 disables shedding. A request counts
+    while its view runs: streamed response bodies do not, and views that wait
+    without using the database (the change feed's long-poll) call
+    ``release_slot`` first.
+
+    Each worker counts its own requests exactly and publishes the count in the
+    cache under its own key, which expires once the worker stops serving; the
+    total is the sum over the workers listed in ``WORKERS_KEY``. Nothing is
+    incremented or decremented in the cache, so the total cannot drift. It is
+    shared between worker processes only with a shared cache (``REDIS_URL``).
+    """
+    cache = cache
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(settings.LOAD_SHEDDING_PATHS)
+        self.retry_after = str(settings.LOAD_SHEDDING_RETRY_AFTER)
+        self.limit = settings.LOAD_SHEDDING_MAX_IN_FLIGHT
+        self.key = f'load-shedding:worker:{socket.gethostname()}:{os.getpid()}:{id(self)}'
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        if not self.limit or not request.path.startswith(self.paths):
+            return self.get_response(request)
+        if self.enter() > self.limit:
+            self.leave()
+            response = JsonResponse({'Status': False, 'Error': 'Server is overloaded, retry later'}, status=503)
+            response['Retry-After'] = self.retry_after
+            return response
+        request._load_shedding_release = self.leave
+        try:
+            return self.get_response(request)
+        finally:
+            release_slot(request)
+
+    def enter(self):
+        """Count a request in this worker and return the number in flight in all workers."""
+        count = self.publish(1)
+        workers = self.cache.get(WORKERS_KEY) or []
+        counts = self.cache.get_many(workers)
+        if self.key not in workers:
+            # Register this worker, dropping workers whose counts have expired.
+            self.cache.set(WORKERS_KEY, [key for key in workers if key in counts] + [self.key], None)
+        counts[self.key] = count
+        return sum(counts.values())
+
+    def leave(self):
+        self.publish(-1)
+
+    def publish(self, delta):
+        with self.lock:
+            self.in_flight += delta
+            self.cache.set(self.key, self.in_flight, WORKER_TTL)
+            return self.in_flight
+
+
+class EventStreamGZipMiddleware(GZipMiddleware):
+    """
+    ``GZipMiddleware`` that leaves Server-Sent Events uncompressed.
+
+    A compressed stream holds every event back until the compressor emits a
+    block, so clients would receive changes late and in bursts.
+    """
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response
+        return super().process_response(request, response)
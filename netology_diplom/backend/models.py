@@ -1,9 +1,29 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models, router, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 
 
-class Shop(models.Model):
+class CatalogModel(models.Model):
+    """
+    A model whose writes are recorded in the catalog change log.
+
+    ``save()`` runs in a transaction on ``default``, where the post_save
+    handler appends the ``CatalogChange``, and on the row's own database, so
+    the row and its change commit together even outside ``atomic()``.
+    """
+    class Meta:
+        abstract = True
+
+    def save(self, *args, using=None, **kwargs):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=DEFAULT_DB_ALIAS, savepoint=False), \
+                transaction.atomic(using=using, savepoint=False):
+            super().save(*args, using=using, **kwargs)
+
+
+class Shop(CatalogModel):
     name = models.CharField(max_length=50, unique=True)
     url = models.URLField(unique=True)
     user = models.OneToOneField(User, verbose_name='User',
@@ -20,9 +40,25 @@ class Shop(models.Model):
         return self.name
 
 
-class Category(models.Model):
+class ShopShard(models.Model):
+    shop = models.OneToOneField(Shop, verbose_name='Shop',
+                                related_name='shard',
+                                primary_key=True,
+                                on_delete=models.CASCADE)
+    database = models.CharField(verbose_name='Database alias', max_length=30)
+
+    class Meta:
+        verbose_name = 'Shop shard'
+        verbose_name_plural = "Shop shards"
+
+    def __str__(self):
+        return f"{self.shop_id} -> {self.database}"
+
+
+class Category(CatalogModel):
     name = models.CharField(max_length=40, unique=True)
-    shops = models.ManyToManyField(Shop, verbose_name='Shops', related_name='categories', blank=True)
+    shops = models.ManyToManyField(Shop, verbose_name='Shops', related_name='categories', blank=True,
+                                   through='CategoryShop')
 
     class Meta:
         verbose_name = 'Category'
@@ -33,7 +69,29 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class CategoryShop(models.Model):
+    # Keeps the table of the former auto-created through model.
+    category = models.ForeignKey(Category, verbose_name='Category',
+                                 related_name='shop_links',
+                                 on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Shop',
+                             related_name='category_links',
+                             on_delete=models.CASCADE)
+    offer_count = models.PositiveIntegerField(verbose_name='Offer count', default=0)
+
+    class Meta:
+        db_table = 'backend_category_shops'
+        verbose_name = 'Category shop'
+        verbose_name_plural = "Category shops"
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'shop'], name='unique_category_shop'),
+        ]
+
+    def __str__(self):
+        return f"{self.category_id} @ {self.shop_id}: {self.offer_count}"
+
+
+class Product(CatalogModel):
     name = models.CharField(max_length=80, unique=True)
     category = models.ForeignKey(Category, verbose_name='Category',
                                 related_name='products', blank=True,
@@ -48,7 +106,19 @@ class Product(models.Model):
         return self.name
 
 
-class ProductInfo(models.Model):
+class ShardedQuerySet(models.QuerySet):
+    """``create()`` lets the database router pick the shard from the new instance."""
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True)
+        return obj
+
+
+class ProductInfo(CatalogModel):
     external_id = models.PositiveIntegerField(verbose_name='External ID')
     product = models.ForeignKey(Product, verbose_name='Product',
                                related_name='product_infos',
@@ -68,17 +138,46 @@ class ProductInfo(models.Model):
                                    verbose_name='Recommended retail price',
                                    validators=[MinValueValidator(0)])
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Product information'
         verbose_name_plural = "Product information"
         constraints = [
             models.UniqueConstraint(fields=['product', 'shop'], name='unique_product_shop'),
         ]
+        indexes = [
+            models.Index(fields=['external_id'], name='product_info_external_id'),
+        ]
 
     def __str__(self):
         return f"{self.shop.name} - {self.product.name}"
 
 
+class ProductOfferSummary(models.Model):
+    product = models.OneToOneField(Product, verbose_name='Product',
+                                   related_name='offer_summary',
+                                   primary_key=True,
+                                   on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Cheapest shop',
+                             related_name='+',
+                             blank=True, null=True,
+                             on_delete=models.SET_NULL)
+    min_price = models.DecimalField(max_digits=20, decimal_places=2,
+                                    verbose_name='Minimum price',
+                                    blank=True, null=True)
+    offer_count = models.PositiveIntegerField(verbose_name='Offer count', default=0)
+    total_quantity = models.PositiveIntegerField(verbose_name='Total quantity', default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Product offer summary'
+        verbose_name_plural = "Product offer summaries"
+
+    def __str__(self):
+        return f"{self.product_id}: {self.min_price} x {self.offer_count}"
+
+
 class Parameter(models.Model):
     name = models.CharField(max_length=40, unique=True)
 
@@ -91,7 +190,7 @@ class Parameter(models.Model):
         return self.name
 
 
-class ProductParameter(models.Model):
+class ProductParameter(CatalogModel):
     product_info = models.ForeignKey(ProductInfo, verbose_name='Product information',
                                    related_name='product_parameters',
                                    blank=True,
@@ -102,6 +201,8 @@ class ProductParameter(models.Model):
                                 on_delete=models.CASCADE)
     value = models.CharField(verbose_name='Value', max_length=100)
 
+    objects = ShardedQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Product parameter'
         verbose_name_plural = "Product parameters"
@@ -135,6 +236,14 @@ class Order(models.Model):
         verbose_name = 'Order'
         verbose_name_plural = "Orders"
         ordering = ('-dt',)
+        indexes = [
+            models.Index(fields=['state', '-dt'], name='order_state_dt'),
+            models.Index(fields=['-dt'], name='order_dt'),
+        ]
+        constraints = [
+            # Concurrent get_or_create calls for a user's cart fall back to fetching the winner's row.
+            models.UniqueConstraint(fields=['user'], condition=models.Q(state='cart'), name='unique_user_cart'),
+        ]
 
     def __str__(self):
         return str(self.dt)
@@ -145,9 +254,11 @@ class OrderItem(models.Model):
                              related_name='ordered_items',
                              blank=True,
                              on_delete=models.CASCADE)
+    # No database constraint: with PRODUCT_SHARDS the offer lives on a shard.
     product_info = models.ForeignKey(ProductInfo, verbose_name='Product information',
                                    related_name='ordered_items',
                                    blank=True,
+                                   db_constraint=False,
                                    on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name='Quantity')
 
@@ -162,6 +273,35 @@ class OrderItem(models.Model):
         return str(self.order.dt)
 
 
+class ShopOrder(models.Model):
+    STATE_CHOICES = tuple(choice for choice in Order.STATE_CHOICES if choice[0] != 'cart')
+
+    order = models.ForeignKey(Order, verbose_name='Order',
+                              related_name='shop_orders',
+                              on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Shop',
+                             related_name='shop_orders',
+                             on_delete=models.CASCADE)
+    state = models.CharField(verbose_name='Status', max_length=15, choices=STATE_CHOICES, default='new')
+    item_count = models.PositiveIntegerField(verbose_name='Item count')
+    subtotal = models.DecimalField(max_digits=20, decimal_places=2, verbose_name='Subtotal')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Shop order'
+        verbose_name_plural = "Shop orders"
+        ordering = ('-created',)
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'shop'], name='unique_order_shop'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'state', '-created'], name='shop_order_inbox'),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id} - {self.shop_id}"
+
+
 class Contact(models.Model):
     user = models.ForeignKey(User, verbose_name='User',
                             related_name='contacts',
@@ -181,3 +321,51 @@ class Contact(models.Model):
 
     def __str__(self):
         return f"{self.city} {self.street} {self.house}"
+
+
+class CatalogChange(models.Model):
+    ACTION_CHOICES = (
+        ('upsert', 'Upsert'),
+        ('delete', 'Delete'),
+    )
+
+    model = models.CharField(verbose_name='Model', max_length=30)
+    object_id = models.BigIntegerField(verbose_name='Object ID')
+    action = models.CharField(verbose_name='Action', max_length=10, choices=ACTION_CHOICES)
+    data = models.JSONField(verbose_name='Data', encoder=DjangoJSONEncoder, blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Catalog change'
+        verbose_name_plural = "Catalog changes"
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['model', 'object_id'], name='catalog_change_object'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.action} {self.model}:{self.object_id}"
+
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, verbose_name='User',
+                             related_name='idempotency_keys',
+                             on_delete=models.CASCADE)
+    key = models.CharField(verbose_name='Key', max_length=255)
+    request_hash = models.CharField(verbose_name='Request hash', max_length=64)
+    response_status = models.PositiveSmallIntegerField(verbose_name='Response status', blank=True, null=True)
+    response_body = models.JSONField(verbose_name='Response body', encoder=DjangoJSONEncoder,
+                                     blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    claimed = models.DateTimeField(verbose_name='Claimed', default=timezone.now)
+    expires = models.DateTimeField(verbose_name='Expires', db_index=True)
+
+    class Meta:
+        verbose_name = 'Idempotency key'
+        verbose_name_plural = "Idempotency keys"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_user_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,79 @@
+"""
+Best-offer summaries: the cheapest in-stock offer from an active shop per product.
+
+Summaries are refreshed for the affected products only. Signal handlers call
+``offers_changed`` for single-row edits, which refreshes once the edit has
+committed (so cascading deletes never race with the upsert); bulk writers (the catalog import) wrap
+their work in ``deferred_offer_refresh`` so every touched product is refreshed
+once, in one pass, before the transaction commits.
+"""
+import threading
+from contextlib import contextmanager
+from operator import itemgetter
+
+from django.db import transaction
+
+from .models import Product, ProductInfo, ProductOfferSummary
+from .sharding import fan_out
+
+BATCH_SIZE = 1000
+
+_deferred = threading.local()
+
+
+def refresh_offer_summaries(product_ids):
+    """Recompute summaries for the given products and upsert them in bulk."""
+    product_ids = sorted(set(product_ids))
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        _refresh_batch(product_ids[start:start + BATCH_SIZE])
+
+
+def _refresh_batch(product_ids):
+    existing = Product.objects.filter(id__in=product_ids).values_list('id', flat=True)
+    summaries = {product_id: ProductOfferSummary(product_id=product_id) for product_id in existing}
+    if not summaries:
+        return
+
+    offers = (ProductInfo.objects
+              .filter(product_id__in=summaries, quantity__gt=0, shop__state=True)
+              .order_by('product_id', 'price', 'shop_id')
+              .values_list('product_id', 'shop_id', 'price', 'quantity'))
+    for product_id, shop_id, price, quantity in fan_out(offers, key=itemgetter(0, 2, 1)):
+        summary = summaries[product_id]
+        if not summary.offer_count:
+            summary.shop_id = shop_id
+            summary.min_price = price
+        summary.offer_count += 1
+        summary.total_quantity += quantity
+
+    ProductOfferSummary.objects.bulk_create(
+        summaries.values(),
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['shop', 'min_price', 'offer_count', 'total_quantity', 'updated'],
+    )
+
+
+def offers_changed(product_ids):
+    """Refresh after commit, or collect the ids if a deferred refresh is in progress."""
+    product_ids = set(product_ids)
+    pending = getattr(_deferred, 'product_ids', None)
+    if pending is not None:
+        pending.update(product_ids)
+    else:
+        transaction.on_commit(lambda: refresh_offer_summaries(product_ids))
+
+
+@contextmanager
+def deferred_offer_refresh():
+    """Collect changed products inside the block and refresh them once on exit."""
+    if getattr(_deferred, 'product_ids', None) is not None:
+        yield
+        return
+    _deferred.product_ids = set()
+    try:
+        yield
+        product_ids = _deferred.product_ids
+    finally:
+        _deferred.product_ids = None
+    refresh_offer_summaries(product_ids)
@@ -0,0 +1,41 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson.
+
+    Values orjson cannot encode natively (``Decimal``, lazy strings, ...) and
+    dates and times, which orjson would format differently, go through DRF's
+    encoder, so the output matches ``JSONRenderer``. Non-string keys, e.g. the
+    item indexes in ``ListField`` errors, are converted to strings. Falls back
+    to ``JSONRenderer`` when orjson is not installed or indentation is
+    requested by the browsable API.
+    """
+    _encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        ret = orjson.dumps(data, default=self._encoder.default,
+                           option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        # JSONRenderer escapes these for JavaScript compatibility; do the same.
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets views negotiate ``text/event-stream`` and stream Server-Sent Events."""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
@@ -0,0 +1,112 @@
+"""
+Moving data between databases when ``PRODUCT_SHARDS`` is enabled or changed.
+
+``copy_reference_data`` brings the reference tables of the shards in line
+with ``default``; afterwards the signal handlers keep them replicated.
+
+``move_shop_offers`` moves every offer of a shop to one shard, wherever the
+offers are: on the shard the shop is pinned to, on ``default`` (imported
+before sharding was enabled) or left on another shard by an interrupted move.
+Offers get ids from the target shard's range and order items are re-pointed
+to them.
+"""
+from contextlib import ExitStack
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, When
+
+from .changes import deferred_changes, record_change
+from .models import Shop, ProductInfo, ProductParameter, OrderItem
+from .offers import deferred_offer_refresh
+from .sharding import REFERENCE_MODELS, shard_for_shop, pin_shop
+
+BATCH_SIZE = 1000
+
+
+def batches(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def copy_reference_data(aliases=None):
+    """Copy new and changed reference rows from ``default`` to the shards and drop rows deleted there."""
+    aliases = aliases or settings.PRODUCT_SHARDS
+    for model in REFERENCE_MODELS:
+        pk = model._meta.pk
+        update_fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+        ids = set(model.objects.using(DEFAULT_DB_ALIAS).values_list('pk', flat=True))
+        for alias in aliases:
+            stale = set(model.objects.using(alias).values_list('pk', flat=True)) - ids
+            for batch in batches(sorted(stale)):
+                model.objects.using(alias).filter(pk__in=batch).delete()
+        for batch in batches(model.objects.using(DEFAULT_DB_ALIAS).order_by('pk').iterator(chunk_size=BATCH_SIZE)):
+            if model is Shop:
+                for shop in batch:
+                    shop.user_id = None
+            for alias in aliases:
+                model.objects.using(alias).bulk_create(batch, update_conflicts=True,
+                                                       unique_fields=[pk.name], update_fields=update_fields)
+
+
+def move_shop_offers(shop_id, target):
+    """
+    Move all offers of the shop to ``target``, pin the shop there and return the number of copied offers.
+
+    Not atomic across databases: the target commits first, then ``default``
+    (order items and the pin), the sources last. Each run starts from what is
+    stored rather than from the pin, so re-running after an interruption
+    finishes the move: offers on the target are discarded while the shop is
+    not pinned there yet, and offers left on any other database are merged
+    into the target's offers of the same product before they are deleted.
+    """
+    pinned = shard_for_shop(shop_id, cached=False)
+    sources = [alias for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *settings.PRODUCT_SHARDS])
+               if alias != target and ProductInfo.objects.using(alias).filter(shop_id=shop_id).exists()]
+
+    with ExitStack() as stack:
+        for alias in [*(alias for alias in sources if alias != DEFAULT_DB_ALIAS), DEFAULT_DB_ALIAS, target]:
+            stack.enter_context(transaction.atomic(using=alias))
+        stack.enter_context(deferred_changes())
+        stack.enter_context(deferred_offer_refresh())
+
+        if pinned != target:
+            ProductInfo.objects.using(target).filter(shop_id=shop_id).delete()
+        moved = sum(copy_offers(shop_id, source, target) for source in sources)
+        for source in sources:
+            ProductInfo.objects.using(source).filter(shop_id=shop_id).delete()
+        pin_shop(shop_id, target)
+    return moved
+
+
+def copy_offers(shop_id, source, target):
+    """Copy the shop's offers missing on ``target`` and re-point order items from ``source`` ids to target ids."""
+    product_infos = list(ProductInfo.objects.using(source).filter(shop_id=shop_id).order_by('id'))
+    existing = dict(ProductInfo.objects.using(target).filter(shop_id=shop_id).values_list('product_id', 'id'))
+    new_ids = {product_info.pk: existing[product_info.product_id]
+               for product_info in product_infos if product_info.product_id in existing}
+
+    copies = [product_info for product_info in product_infos if product_info.pk not in new_ids]
+    old_ids = [product_info.pk for product_info in copies]
+    parameters = [parameter for parameter in (ProductParameter.objects.using(source)
+                                              .filter(product_info__shop_id=shop_id).order_by('id'))
+                  if parameter.product_info_id not in new_ids]
+    for obj in copies + parameters:
+        obj.pk = None
+        obj._state.adding = True
+    ProductInfo.objects.using(target).bulk_create(copies, batch_size=BATCH_SIZE)
+    new_ids.update(zip(old_ids, (product_info.pk for product_info in copies)))
+
+    for parameter in parameters:
+        parameter.product_info_id = new_ids[parameter.product_info_id]
+    ProductParameter.objects.using(target).bulk_create(parameters, batch_size=BATCH_SIZE)
+
+    for batch in batches(new_ids):
+        OrderItem.objects.filter(product_info_id__in=batch).update(product_info_id=Case(
+            *(When(product_info_id=old_id, then=new_ids[old_id]) for old_id in batch)))
+
+    for obj in copies + parameters:
+        record_change(obj, 'upsert')
+    return len(copies)
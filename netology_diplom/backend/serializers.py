@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Shop, Category, Product, ProductInfo, Order, OrderItem, Contact
+from django.contrib.auth.password_validation import validate_password
+from .sharding import db_for_product_info
+from .models import Shop, Category, Product, ProductInfo, ProductOfferSummary, Order, OrderItem, ShopOrder, Contact
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,6 +14,14 @@ class UserSerializer(serializers.ModelSerializer):
         user = User.objects.create_user(**validated_data)
         return user
 
+class RegisterSerializer(UserSerializer):
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ['password']
+
+    def validate_password(self, value):
+        validate_password(value)
+        return value
+
 class ShopSerializer(serializers.ModelSerializer):
     class Meta:
         model = Shop
@@ -29,6 +39,25 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'name', 'category']
 
+class ProductOfferSummarySerializer(serializers.ModelSerializer):
+    shop = ShopSerializer(read_only=True)
+    summary = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProductOfferSummary
+        fields = ['min_price', 'shop', 'offer_count', 'total_quantity', 'summary']
+
+    def get_summary(self, obj):
+        if not obj.offer_count:
+            return 'out of stock'
+        return f'from {obj.min_price} ₽ in {obj.offer_count} shops'
+
+class ProductListSerializer(ProductSerializer):
+    offers = ProductOfferSummarySerializer(source='offer_summary', read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ['offers']
+
 class ProductInfoSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     shop = ShopSerializer(read_only=True)
@@ -43,7 +72,20 @@ class ContactSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'city', 'street', 'house', 'structure', 
                  'building', 'apartment', 'phone']
 
+class ProductInfoField(serializers.PrimaryKeyRelatedField):
+    """Looks the offer up on the database that holds it (see backend/sharding.py)."""
+
+    def to_internal_value(self, data):
+        try:
+            return self.get_queryset().using(db_for_product_info(int(data))).get(pk=data)
+        except ProductInfo.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
 class OrderItemSerializer(serializers.ModelSerializer):
+    product_info = ProductInfoField(queryset=ProductInfo.objects.all())
+
     class Meta:
         model = OrderItem
         fields = ['id', 'product_info', 'quantity']
@@ -58,3 +100,25 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def get_total_sum(self, obj):
         return sum(item.quantity * item.product_info.price for item in obj.ordered_items.all())
+
+class ShopOrderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShopOrder
+        fields = ['id', 'order', 'shop', 'state', 'item_count', 'subtotal', 'created']
+
+class ShopOrderStateSerializer(serializers.Serializer):
+    state = serializers.ChoiceField(choices=ShopOrder.STATE_CHOICES)
+
+class CartBatchItemSerializer(serializers.Serializer):
+    product_info = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+
+class CartBatchSerializer(serializers.Serializer):
+    MAX_ITEMS = 100
+
+    items = CartBatchItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, value):
+        if len(value) > self.MAX_ITEMS:
+            raise serializers.ValidationError(f'No more than {self.MAX_ITEMS} items per request')
+        return value
@@ -0,0 +1,209 @@
+"""
+Optional sharding of offer data (``ProductInfo``, ``ProductParameter``) by shop.
+
+``PRODUCT_SHARDS`` lists the database aliases that hold offers; when it is
+empty everything lives in ``default`` and this module is a no-op.
+
+* Every shop's offers live on one shard: ``ShopShard`` pins a shop to a
+  shard (set by ``move_shop``), otherwise ``shop_id % len(shards)`` decides.
+  The mapping is cached for ``SHOP_SHARD_TTL`` seconds.
+* Reference tables (shops, categories and their shops, products,
+  parameters) are written to ``default`` and replicated to every shard, so
+  shard-local queries can still join and ``select_related`` them. Shop
+  replicas carry no user: users only exist in ``default``.
+* Offer ids are globally unique: shard *n* (1-based) allocates ids from
+  ``n * SHARD_ID_SPAN``, so any offer id tells which shard holds it.
+* Queries that span shops go through ``fan_out``, which runs the query on every
+  shard (in parallel outside transactions) and merge-sorts the results.
+"""
+import copy
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import Shop, Category, Product, Parameter, ProductInfo, ProductParameter, ShopShard
+
+SHARD_ID_SPAN = 10 ** 12
+
+# Seconds a worker may serve a stale shop -> shard mapping after ``move_shop``.
+SHOP_SHARD_TTL = 30
+
+SHARDED_MODELS = (ProductInfo, ProductParameter)
+REFERENCE_MODELS = (Shop, Category, Category.shops.through, Product, Parameter)
+
+# Shards hold every backend table (deletes cascade through them) and the tables those reference.
+SHARD_APPS = {'backend', 'auth', 'contenttypes'}
+
+
+def is_sharded():
+    return bool(settings.PRODUCT_SHARDS)
+
+
+def product_info_databases():
+    return list(settings.PRODUCT_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def shop_shard_key(shop_id):
+    return f'shop-shard:{shop_id}'
+
+
+def shard_for_shop(shop_id, cached=True):
+    """
+    The database holding the shop's offers.
+
+    The shop map is cached for ``SHOP_SHARD_TTL`` seconds; with a per-process
+    cache that is how long other workers may keep using a shard a shop was
+    just moved away from. Writers pass ``cached=False`` to read the map itself.
+    """
+    shards = settings.PRODUCT_SHARDS
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    key = shop_shard_key(shop_id)
+    alias = cache.get(key) if cached else None
+    if alias is None:
+        alias = (ShopShard.objects.using(DEFAULT_DB_ALIAS).filter(shop_id=shop_id)
+                 .values_list('database', flat=True).first()) or shards[shop_id % len(shards)]
+        cache.set(key, alias, SHOP_SHARD_TTL)
+    return alias
+
+
+def pin_shop(shop_id, alias):
+    ShopShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(shop_id=shop_id, defaults={'database': alias})
+    transaction.on_commit(lambda: cache.set(shop_shard_key(shop_id), alias, SHOP_SHARD_TTL),
+                          using=DEFAULT_DB_ALIAS)
+
+
+def db_for_product_info(product_info_id):
+    shards = settings.PRODUCT_SHARDS
+    index = int(product_info_id) // SHARD_ID_SPAN
+    if not shards or not 1 <= index <= len(shards):
+        return DEFAULT_DB_ALIAS
+    return shards[index - 1]
+
+
+def group_by_database(product_info_ids):
+    groups = {}
+    for product_info_id in product_info_ids:
+        groups.setdefault(db_for_product_info(product_info_id), []).append(product_info_id)
+    return groups
+
+
+def _run(queryset, alias, close):
+    try:
+        return list(queryset.using(alias))
+    finally:
+        if close:
+            connections[alias].close()
+
+
+def fan_out(queryset, aliases=None, key=None):
+    """
+    Evaluate ``queryset`` on every offer database and combine the results.
+
+    With ``key`` the per-shard results (each already sorted by the queryset's
+    ordering) are merge-sorted; slicing, if any, applies per shard. Inside a
+    transaction the shards are queried sequentially on this thread's
+    connections, so the caller sees its own uncommitted writes.
+    """
+    aliases = aliases or product_info_databases()
+    if len(aliases) == 1:
+        return list(queryset.using(aliases[0]))
+    if any(connections[alias].in_atomic_block for alias in aliases):
+        results = [_run(queryset, alias, close=False) for alias in aliases]
+    else:
+        with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+            results = list(pool.map(lambda alias: _run(queryset, alias, close=True), aliases))
+    return list(heapq.merge(*results, key=key)) if key else list(chain.from_iterable(results))
+
+
+def product_info_values(product_info_ids, *fields):
+    """``values_list(*fields)`` of the given offers, each read from its own shard."""
+    groups = group_by_database(set(product_info_ids))
+    return list(chain.from_iterable(
+        ProductInfo.objects.using(alias).filter(id__in=ids).values_list(*fields)
+        for alias, ids in groups.items()
+    ))
+
+
+def replicate(instance):
+    for alias in settings.PRODUCT_SHARDS:
+        replica = copy.copy(instance)
+        if isinstance(replica, Shop):
+            user = Shop._meta.get_field('user')
+            if user.is_cached(replica):
+                user.delete_cached_value(replica)
+            replica.user_id = None
+        replica.save(using=alias)
+
+
+def replicate_delete(instance):
+    for alias in settings.PRODUCT_SHARDS:
+        type(instance).objects.using(alias).filter(pk=instance.pk).delete()
+
+
+def replicate_category_shops(category_ids):
+    through = Category.shops.through
+    rows = list(through.objects.using(DEFAULT_DB_ALIAS).filter(category_id__in=category_ids))
+    for alias in settings.PRODUCT_SHARDS:
+        through.objects.using(alias).filter(category_id__in=category_ids).delete()
+        through.objects.using(alias).bulk_create(rows)
+
+
+def init_shard_sequences(aliases=None):
+    """Make each shard allocate offer ids from its own ``SHARD_ID_SPAN`` range."""
+    for alias in aliases or settings.PRODUCT_SHARDS:
+        start = (settings.PRODUCT_SHARDS.index(alias) + 1) * SHARD_ID_SPAN
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            for model in SHARDED_MODELS:
+                table = model._meta.db_table
+                if connection.vendor == 'postgresql':
+                    cursor.execute(f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                                   f"GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {table})))",
+                                   [table, start - 1])
+                elif connection.vendor == 'sqlite':
+                    cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s',
+                                   [start - 1, table])
+                    if not cursor.rowcount:
+                        cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                                       [table, start - 1])
+
+
+class ShopShardRouter:
+    """Routes offers to their shop's shard; everything else stays on ``default``."""
+
+    def _db_for_offers(self, model, **hints):
+        if model not in SHARDED_MODELS or not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        # A new offer inherits the database of whatever was assigned to it first; route it by shop instead.
+        if isinstance(instance, SHARDED_MODELS) and instance._state.db and not instance._state.adding:
+            return instance._state.db
+        if isinstance(instance, ProductInfo):
+            return db_for_product_info(instance.pk) if instance.pk else shard_for_shop(instance.shop_id)
+        if isinstance(instance, Shop):
+            return shard_for_shop(instance.pk)
+        product_info_id = getattr(instance, 'product_info_id', None)
+        if product_info_id:
+            return db_for_product_info(product_info_id)
+        return None
+
+    db_for_read = _db_for_offers
+    db_for_write = _db_for_offers
+
+    def allow_relation(self, obj1, obj2, **hints):
+        models = SHARDED_MODELS + REFERENCE_MODELS
+        if is_sharded() and (isinstance(obj1, models) or isinstance(obj2, models)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.PRODUCT_SHARDS:
+            return app_label in SHARD_APPS
+        return None
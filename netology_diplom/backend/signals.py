@@ -0,0 +1,127 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed, post_migrate
+from django.dispatch import receiver
+
+from .models import Shop, Category, ProductInfo
+from .offers import offers_changed
+from .changes import TRACKED_MODELS, record_change
+from .sharding import (REFERENCE_MODELS, SHARDED_MODELS, shard_for_shop, replicate, replicate_delete,
+                       replicate_category_shops, init_shard_sequences)
+from .snapshots import publish_snapshots, withdraw_shop_snapshot
+from .categories import shop_categories_key
+
+
+def is_replica_write(sender, using):
+    """Writes of reference data to shards only copy what was already handled on ``default``."""
+    return using != DEFAULT_DB_ALIAS and sender not in SHARDED_MODELS
+
+
+@receiver(pre_save, sender=Shop)
+def remember_shop_state(sender, instance, using, **kwargs):
+    instance._previous_state = None
+    if instance.pk and not is_replica_write(sender, using):
+        instance._previous_state = (Shop.objects.filter(pk=instance.pk)
+                                    .values_list('state', flat=True).first())
+
+
+@receiver(post_save, sender=Shop)
+def refresh_offers_on_shop_state(sender, instance, created, using, **kwargs):
+    if created or is_replica_write(sender, using) or instance._previous_state == instance.state:
+        return
+    offers_changed(ProductInfo.objects.using(shard_for_shop(instance.pk)).filter(shop=instance)
+                   .values_list('product_id', flat=True))
+    snapshot = publish_snapshots if instance.state else withdraw_shop_snapshot
+    transaction.on_commit(partial(snapshot, instance.pk), robust=True)
+
+
+@receiver(post_delete, sender=Shop)
+def forget_shop_categories(sender, instance, using, **kwargs):
+    if not is_replica_write(sender, using):
+        transaction.on_commit(partial(cache.delete, shop_categories_key(instance.pk)))
+
+
+@receiver(post_delete, sender=Shop)
+def withdraw_snapshot_on_delete(sender, instance, using, **kwargs):
+    if not is_replica_write(sender, using):
+        transaction.on_commit(partial(withdraw_shop_snapshot, instance.pk), robust=True)
+
+
+@receiver(pre_save, sender=ProductInfo)
+def remember_product_info_product(sender, instance, using, **kwargs):
+    instance._previous_product_id = None
+    if instance.pk:
+        instance._previous_product_id = (ProductInfo.objects.using(using).filter(pk=instance.pk)
+                                         .values_list('product_id', flat=True).first())
+
+
+@receiver(post_save, sender=ProductInfo)
+def refresh_offers_on_save(sender, instance, **kwargs):
+    product_ids = {instance.product_id}
+    if instance._previous_product_id:
+        product_ids.add(instance._previous_product_id)
+    offers_changed(product_ids)
+
+
+@receiver(post_delete, sender=ProductInfo)
+def refresh_offers_on_delete(sender, instance, **kwargs):
+    offers_changed([instance.product_id])
+
+
+def record_catalog_save(sender, instance, using, raw=False, **kwargs):
+    if not raw and not is_replica_write(sender, using):
+        record_change(instance, 'upsert')
+
+
+def record_catalog_delete(sender, instance, using, **kwargs):
+    if not is_replica_write(sender, using):
+        record_change(instance, 'delete')
+
+
+for model in TRACKED_MODELS:
+    post_save.connect(record_catalog_save, sender=model, dispatch_uid=f'catalog_save_{model._meta.model_name}')
+    post_delete.connect(record_catalog_delete, sender=model, dispatch_uid=f'catalog_delete_{model._meta.model_name}')
+
+
+def replicate_save(sender, instance, using, raw=False, **kwargs):
+    if not raw and using == DEFAULT_DB_ALIAS and settings.PRODUCT_SHARDS:
+        replicate(instance)
+
+
+def replicate_deletion(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS and settings.PRODUCT_SHARDS:
+        replicate_delete(instance)
+
+
+for model in REFERENCE_MODELS:
+    post_save.connect(replicate_save, sender=model, dispatch_uid=f'replicate_save_{model._meta.model_name}')
+    post_delete.connect(replicate_deletion, sender=model, dispatch_uid=f'replicate_delete_{model._meta.model_name}')
+
+
+@receiver(m2m_changed, sender=Category.shops.through)
+def record_category_shops(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if using != DEFAULT_DB_ALIAS:
+        return
+    if reverse and action == 'pre_clear':
+        instance._cleared_category_ids = list(instance.categories.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        categories = [instance]
+    else:
+        category_ids = instance._cleared_category_ids if action == 'post_clear' else pk_set
+        categories = list(Category.objects.filter(pk__in=category_ids))
+    for category in categories:
+        record_change(category, 'upsert')
+    if settings.PRODUCT_SHARDS:
+        replicate_category_shops([category.pk for category in categories])
+
+
+@receiver(post_migrate)
+def init_shard(sender, using, **kwargs):
+    if sender.name == 'backend' and using in settings.PRODUCT_SHARDS:
+        init_shard_sequences([using])
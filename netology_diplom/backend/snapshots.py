@@ -0,0 +1,221 @@
+"""
+Prebuilt catalog snapshots.
+
+After a shop's import commits, its offers are written once to
+``SNAPSHOT_ROOT/shop-<id>/`` as gzip-compressed JSON and CSV files named by
+the sha256 of their bytes. Files are immutable; ``manifest.json`` in each
+directory points at the current ones and is swapped atomically with
+``os.replace``, so readers never see a partial snapshot and serving one needs
+no database query. Deactivating or deleting a shop removes its snapshot.
+
+The aggregate catalog of all active shops in ``SNAPSHOT_ROOT/all/`` is
+recomposed from the per-shop files outside the request path: every change
+above only marks it stale, and ``publish_snapshots --stale`` (run
+periodically) rebuilds it under a PostgreSQL advisory lock, so concurrent
+rebuilds cannot publish an older composition over a newer one.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Shop, ProductInfo, ProductParameter
+from .sharding import shard_for_shop
+
+KINDS = ('json', 'csv')
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+}
+
+COLUMNS = ('id', 'external_id', 'product', 'product_name', 'category', 'category_name',
+           'shop', 'name', 'model', 'quantity', 'price', 'price_rrc', 'parameters')
+
+AGGREGATE = 'all'
+
+STALE_MARKER = 'aggregate.stale'
+
+SNAPSHOT_LOCK_ID = 0x736e617073686f74  # "snapshot"
+
+
+def snapshot_name(scope):
+    return AGGREGATE if scope == AGGREGATE else f'shop-{scope}'
+
+
+def snapshot_dir(scope):
+    return os.path.join(settings.SNAPSHOT_ROOT, snapshot_name(scope))
+
+
+def read_manifest(scope):
+    try:
+        with open(os.path.join(snapshot_dir(scope), 'manifest.json'), 'rb') as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return None
+
+
+def open_snapshot(scope, kind):
+    """Return the open snapshot file and its manifest entry, or ``(None, None)``."""
+    manifest = read_manifest(scope)
+    if not manifest or kind not in manifest:
+        return None, None
+    entry = manifest[kind]
+    try:
+        return open(os.path.join(snapshot_dir(scope), entry['file']), 'rb'), entry
+    except FileNotFoundError:
+        return None, None
+
+
+def shop_rows(shop_id):
+    database = shard_for_shop(shop_id)
+    offers = list(ProductInfo.objects.using(database)
+                  .filter(shop_id=shop_id)
+                  .order_by('id')
+                  .values_list('id', 'external_id', 'product_id', 'product__name',
+                               'product__category_id', 'product__category__name',
+                               'shop_id', 'name', 'model', 'quantity', 'price', 'price_rrc'))
+    parameters = defaultdict(dict)
+    for product_info_id, name, value in (ProductParameter.objects.using(database)
+                                         .filter(product_info__shop_id=shop_id)
+                                         .order_by('product_info_id', 'parameter__name')
+                                         .values_list('product_info_id', 'parameter__name', 'value')):
+        parameters[product_info_id][name] = value
+    return [dict(zip(COLUMNS, offer + (parameters[offer[0]],))) for offer in offers]
+
+
+def render_json(rows):
+    return json.dumps(rows, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def render_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow([json.dumps(row['parameters'], ensure_ascii=False) if column == 'parameters'
+                         else row[column] for column in COLUMNS])
+    return buffer.getvalue().encode()
+
+
+def write_atomic(path, content):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+def write_snapshot(scope, documents, offers):
+    """
+    Store ``{kind: bytes}`` as content-addressed gzip files and point the manifest at them.
+
+    Files of the previous manifest are kept for downloads still in progress;
+    anything older is removed.
+    """
+    directory = snapshot_dir(scope)
+    os.makedirs(directory, exist_ok=True)
+    previous = read_manifest(scope) or {}
+    created = timezone.now().isoformat()
+    manifest = {}
+    for kind, document in documents.items():
+        content = gzip.compress(document, mtime=0)
+        digest = hashlib.sha256(content).hexdigest()
+        name = f'{digest}.{kind}.gz'
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            write_atomic(path, content)
+        manifest[kind] = {'file': name, 'path': f'{snapshot_name(scope)}/{name}',
+                          'sha256': digest, 'size': len(content),
+                          'offers': offers, 'created': created}
+    write_atomic(os.path.join(directory, 'manifest.json'), json.dumps(manifest).encode())
+
+    keep = {entry['file'] for entry in (*manifest.values(), *previous.values())} | {'manifest.json'}
+    for name in os.listdir(directory):
+        if name not in keep and not name.endswith('.tmp'):
+            os.remove(os.path.join(directory, name))
+    return manifest
+
+
+def publish_shop_snapshot(shop_id):
+    rows = shop_rows(shop_id)
+    return write_snapshot(shop_id, {'json': render_json(rows), 'csv': render_csv(rows)}, len(rows))
+
+
+def publish_aggregate_snapshot():
+    """Concatenate the current snapshots of all active shops without querying their offers."""
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [SNAPSHOT_LOCK_ID])
+        json_parts, csv_parts, offers = [], [], 0
+        for shop_id in Shop.objects.filter(state=True).order_by('id').values_list('id', flat=True):
+            manifest = read_manifest(shop_id)
+            if not manifest:
+                continue
+            directory = snapshot_dir(shop_id)
+            try:
+                with open(os.path.join(directory, manifest['json']['file']), 'rb') as file:
+                    document = gzip.decompress(file.read())[1:-1]
+                with open(os.path.join(directory, manifest['csv']['file']), 'rb') as file:
+                    rows = gzip.decompress(file.read()).partition(b'\n')[2]
+            except FileNotFoundError:
+                # Removed since the manifest was read; the removal marked the aggregate stale again.
+                continue
+            if document:
+                json_parts.append(document)
+            csv_parts.append(rows)
+            offers += manifest['json']['offers']
+        header = render_csv([])
+        return write_snapshot(AGGREGATE, {'json': b'[' + b','.join(json_parts) + b']',
+                                          'csv': header + b''.join(csv_parts)}, offers)
+
+
+def stale_marker():
+    return os.path.join(settings.SNAPSHOT_ROOT, STALE_MARKER)
+
+
+def mark_aggregate_stale():
+    os.makedirs(settings.SNAPSHOT_ROOT, exist_ok=True)
+    with open(stale_marker(), 'wb'):
+        pass
+
+
+def publish_stale_aggregate():
+    """Rebuild the aggregate if a change marked it stale; return the new manifest or ``None``."""
+    # Taken before the rebuild, so a change made while it runs marks the aggregate stale again.
+    try:
+        os.remove(stale_marker())
+    except FileNotFoundError:
+        return None
+    try:
+        return publish_aggregate_snapshot()
+    except Exception:
+        mark_aggregate_stale()
+        raise
+
+
+def publish_snapshots(shop_id):
+    """Publish the shop's snapshot if it is active and leave the aggregate to the next rebuild."""
+    if not Shop.objects.filter(pk=shop_id, state=True).exists():
+        return
+    publish_shop_snapshot(shop_id)
+    mark_aggregate_stale()
+
+
+def withdraw_shop_snapshot(shop_id):
+    """Remove the snapshot of a deactivated or deleted shop."""
+    directory = snapshot_dir(shop_id)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+        mark_aggregate_stale()
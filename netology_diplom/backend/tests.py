@@ -1,18 +1,61 @@
+import gzip
+import json
 import logging
-from django.test import TestCase
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from unittest import skipUnless
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Shop, Category, Product, Order, OrderItem, ProductInfo
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from .models import (Shop, Category, Product, Order, OrderItem, ProductInfo, ProductOfferSummary, CatalogChange,
+                     IdempotencyKey, ShopOrder, ProductParameter, CategoryShop, Contact, ShopShard)
+from .changes import compact_changes, write_changes
+from .sharding import SHARD_ID_SPAN, init_shard_sequences, pin_shop, shard_for_shop
+from .admin import EstimatedCountPaginator
+from .middleware import LoadSheddingMiddleware, release_slot
+from .renderers import ORJSONRenderer
+from rest_framework.renderers import JSONRenderer
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+from .importer import import_shop_catalog
+from .snapshots import read_manifest
+from .categories import shop_categories_key
 
 User = get_user_model()
 
+# Shard aliases exist only when PRODUCT_SHARDS is configured; offers may be written there by any test.
+TEST_DATABASES = set(settings.DATABASES)
+
 # Настройка логгера
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+def import_shop(user, name, goods):
+    """Import the price list of shop ``name``; ``goods`` are ``(product name, category, price)`` tuples."""
+    categories = {category.id: category for _, category, _ in goods}
+    return import_shop_catalog(user, f"http://{name.replace(' ', '').lower()}.com", {
+        'shop': name,
+        'categories': [{'id': category.id, 'name': category.name} for category in categories.values()],
+        'goods': [{'id': index, 'category': category.id, 'model': "test", 'name': product_name,
+                   'price': price, 'price_rrc': price, 'quantity': 3, 'parameters': {"Color": "black"}}
+                  for index, (product_name, category, price) in enumerate(goods, 1)],
+    })
+
 class ShopTests(TestCase):
+    databases = TEST_DATABASES
+
     def setUp(self):
         logger.info("Настройка тестов покупок")
         self.shop = Shop.objects.create(
@@ -29,6 +72,8 @@ class ShopTests(TestCase):
         self.assertEqual(self.shop.url, "http://testshop.com")
 
 class CategoryTests(TestCase):
+    databases = TEST_DATABASES
+
     def setUp(self):
         logger.info("Настройка тестов категорий")
         self.category = Category.objects.create(
@@ -43,6 +88,8 @@ class CategoryTests(TestCase):
         self.assertEqual(self.category.name, "Test Category")
 
 class ProductTests(TestCase):
+    databases = TEST_DATABASES
+
     def setUp(self):
         logger.info("Настройка тестов товаров")
         self.category = Category.objects.create(name="Test Category")
@@ -60,6 +107,8 @@ class ProductTests(TestCase):
         self.assertEqual(self.product.category, self.category)
 
 class CartAPITests(APITestCase):
+    databases = TEST_DATABASES
+
     def setUp(self):
         logger.info("Настройка API тестов корзины")
         self.user = User.objects.create_user(
@@ -111,6 +160,8 @@ class CartAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 class OrderAPITests(APITestCase):
+    databases = TEST_DATABASES
+
     def setUp(self):
         logger.info("Настройка тестов OrderAPITests")
         self.user = User.objects.create_user(
@@ -157,6 +208,8 @@ class OrderAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 class AuthenticationTests(APITestCase):
+    databases = TEST_DATABASES
+
     def setUp(self):
         logger.info("Настройка тестов аутентификации")
         self.user_data = {
@@ -189,6 +242,8 @@ class AuthenticationTests(APITestCase):
         self.assertIn('token', response.data)
 
 class ProductInfoTests(TestCase):
+    databases = TEST_DATABASES
+
     def setUp(self):
         logger.info("Настройка тестов ProductInfoTests")
         self.shop = Shop.objects.create(name="Test Shop", url="http://testshop.com")
@@ -211,4 +266,884 @@ class ProductInfoTests(TestCase):
         self.assertEqual(self.product_info.shop, self.shop)
         self.assertEqual(self.product_info.quantity, 10)
         self.assertEqual(self.product_info.price, 100)
-        self.assertEqual(self.product_info.price_rrc, 120)
\ No newline at end of file
+        self.assertEqual(self.product_info.price_rrc, 120)
+
+class AccountViewTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов контактов и заказов")
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.other_user = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов контактов и заказов")
+
+    def test_contacts_belong_to_user(self):
+        logger.info("Тестирование контактов пользователя")
+        Contact.objects.create(user=self.other_user, city="Moscow", street="Tverskaya", phone="1")
+        response = self.client.post(reverse('contact-list'), {'user': self.other_user.id, 'city': "Kazan",
+                                                              'street': "Baumana", 'phone': "2"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Contact.objects.get(city="Kazan").user, self.user)
+        response = self.client.get(reverse('contact-list'))
+        self.assertEqual([contact['city'] for contact in response.data], ["Kazan"])
+
+    def test_order_detail(self):
+        logger.info("Тестирование просмотра заказа")
+        order = Order.objects.create(user=self.user, state='new')
+        cart = Order.objects.create(user=self.user, state='cart')
+        other = Order.objects.create(user=self.other_user, state='new')
+        # order-detail is also the router's name for orders/<pk>/
+        response = self.client.get(f'/api/v1/order/{order.id}/')
+        self.assertEqual(response.data['id'], order.id)
+        for order_id in (cart.id, other.id):
+            response = self.client.get(f'/api/v1/order/{order_id}/')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class OfferSummaryTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов OfferSummaryTests")
+        self.user = User.objects.create_user(username='partner', password='testpass123')
+        self.category = Category.objects.create(name="Test Category")
+        self.product = Product.objects.create(name="Test Product", category=self.category)
+        self.shop = Shop.objects.create(name="Test Shop", url="http://testshop.com")
+        self.other_shop = Shop.objects.create(name="Other Shop", url="http://othershop.com")
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов OfferSummaryTests")
+
+    def create_offer(self, shop, price, quantity=5):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductInfo.objects.create(product=self.product, shop=shop, external_id=1,
+                                              name="Test Product", model="test", quantity=quantity,
+                                              price=price, price_rrc=price)
+
+    def test_cheapest_offer_from_active_shop(self):
+        logger.info("Тестирование выбора лучшего предложения")
+        self.create_offer(self.shop, 120)
+        self.create_offer(self.other_shop, 100)
+        summary = ProductOfferSummary.objects.get(product=self.product)
+        self.assertEqual(summary.shop, self.other_shop)
+        self.assertEqual(summary.min_price, 100)
+        self.assertEqual(summary.offer_count, 2)
+        self.assertEqual(summary.total_quantity, 10)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_shop.state = False
+            self.other_shop.save()
+        summary.refresh_from_db()
+        self.assertEqual(summary.shop, self.shop)
+        self.assertEqual(summary.offer_count, 1)
+
+    def test_product_list_summary(self):
+        logger.info("Тестирование сводки предложений в списке товаров")
+        self.create_offer(self.shop, 120)
+        self.create_offer(self.other_shop, 100, quantity=0)
+        response = self.client.get(reverse('product-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['offers']['summary'], 'from 120.00 ₽ in 1 shops')
+
+    def test_import_refreshes_summaries(self):
+        logger.info("Тестирование обновления сводки после импорта")
+        import_shop(self.user, "Partner Shop", [("Test Product", self.category, 90)])
+        summary = ProductOfferSummary.objects.get(product=self.product)
+        self.assertEqual(summary.shop.name, "Partner Shop")
+        self.assertEqual(summary.min_price, 90)
+
+    def test_reimport_keeps_ordered_offers(self):
+        logger.info("Тестирование повторного импорта с заказанными предложениями")
+        other = Product.objects.create(name="Other Product", category=self.category)
+        goods = [{'id': 1, 'category': self.category.id, 'name': "Test Product",
+                  'price': 90, 'price_rrc': 99, 'quantity': 3, 'parameters': {"Color": "black"}},
+                 {'id': 2, 'category': self.category.id, 'name': "Other Product",
+                  'price': 50, 'price_rrc': 50, 'quantity': 1}]
+        price_list = {'shop': "Partner Shop", 'categories': [], 'goods': goods}
+        shop = import_shop_catalog(self.user, "http://partner.com/price.yaml", price_list)
+        offers = ProductInfo.objects.using(shard_for_shop(shop.id))
+        offer = offers.get(shop=shop, product=self.product)
+        order = Order.objects.create(user=self.user, state='new')
+        OrderItem.objects.create(order=order, product_info=offer, quantity=1)
+
+        goods[0].update(price=80, parameters={"Color": "white"})
+        import_shop_catalog(self.user, "http://partner.com/price.yaml", price_list)
+        self.assertEqual(offers.get(shop=shop, product=self.product).id, offer.id)
+        self.assertEqual(offer.product_parameters.get().value, "white")
+
+        price_list['goods'] = goods[1:]
+        import_shop_catalog(self.user, "http://partner.com/price.yaml", price_list)
+        offer.refresh_from_db()
+        self.assertEqual((offer.price, offer.quantity), (80, 0))
+        self.assertEqual(order.ordered_items.get().product_info_id, offer.id)
+
+        price_list['goods'] = []
+        import_shop_catalog(self.user, "http://partner.com/price.yaml", price_list)
+        self.assertFalse(offers.filter(product=other).exists())
+
+    def test_renamed_shop_with_same_url(self):
+        logger.info("Тестирование переименования магазина с тем же URL")
+        with self.assertRaises(ValidationError):
+            import_shop_catalog(self.user, self.shop.url, {'shop': "Renamed Shop", 'goods': []})
+
+class ChangeFeedTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов ChangeFeedTests")
+        self.user = User.objects.create_user(username='consumer', password='testpass123')
+        self.category = Category.objects.create(name="Test Category")
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов ChangeFeedTests")
+
+    def test_changes_since_cursor(self):
+        logger.info("Тестирование чтения изменений после курсора")
+        cursor = CatalogChange.objects.last().id
+        product = Product.objects.create(name="Test Product", category=self.category)
+        product.name = "Renamed Product"
+        product.save()
+        product.delete()
+
+        response = self.client.get(reverse('change-feed'), {'since': cursor})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        changes = response.data['changes']
+        self.assertEqual([change['action'] for change in changes], ['upsert', 'upsert', 'delete'])
+        self.assertEqual(changes[1]['data']['name'], "Renamed Product")
+        self.assertEqual(response.data['cursor'], changes[-1]['id'])
+
+    def test_limit_and_wait_are_clamped(self):
+        logger.info("Тестирование ограничения размера страницы и времени ожидания журнала")
+        cursor = CatalogChange.objects.last().id
+        Product.objects.create(name="First Product", category=self.category)
+        Product.objects.create(name="Second Product", category=self.category)
+        for limit in ('-1', '0'):
+            response = self.client.get(reverse('change-feed'), {'since': cursor, 'limit': limit})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['changes']), 1)
+        response = self.client.get(reverse('change-feed'), {'since': cursor, 'limit': 'all'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for wait in ('nan', 'inf'):
+            response = self.client.get(reverse('change-feed'), {'since': cursor, 'wait': wait})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_writes_collapsed_batch(self):
+        logger.info("Тестирование записи изменений при импорте")
+        cursor = CatalogChange.objects.last().id
+        with mock.patch('backend.changes.write_changes', wraps=write_changes) as written:
+            import_shop(self.user, "Partner Shop", [("Test Product", self.category, 90)])
+        written.assert_called_once()
+        models = list(CatalogChange.objects.filter(id__gt=cursor).values_list('model', flat=True))
+        self.assertEqual(models, ['shop', 'product', 'productinfo', 'productparameter', 'category'])
+        self.assertEqual(CatalogChange.objects.get(id__gt=cursor, model='category').data['shops'],
+                         [Shop.objects.get().id])
+
+    def test_compaction_keeps_latest_change(self):
+        logger.info("Тестирование сжатия журнала изменений")
+        self.category.name = "Renamed Category"
+        self.category.save()
+        self.assertEqual(compact_changes(), 1)
+        change = CatalogChange.objects.get(model='category', object_id=self.category.id)
+        self.assertEqual(change.data['name'], "Renamed Category")
+
+    def test_event_stream_is_not_compressed(self):
+        logger.info("Тестирование потока событий без сжатия")
+        response = self.client.get(reverse('change-feed'), HTTP_ACCEPT='text/event-stream',
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(next(iter(response.streaming_content)), b'retry: 1000\n\n')
+        response.close()
+
+    def test_event_stream_errors_are_json(self):
+        logger.info("Тестирование ошибок для клиентов потока событий")
+        response = self.client.get(reverse('change-feed'), {'wait': 'nan'}, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertFalse(json.loads(response.content)['Status'])
+
+        self.client.force_authenticate(user=None)
+        response = self.client.get(reverse('change-feed'), HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', json.loads(response.content))
+
+    def test_events_match_json_changes(self):
+        logger.info("Тестирование совпадения событий потока с JSON-ответом")
+        cursor = CatalogChange.objects.last().id
+        Product.objects.create(name="Test Product", category=self.category)
+        expected = json.loads(self.client.get(reverse('change-feed'), {'since': cursor}).content)['changes']
+
+        response = self.client.get(reverse('change-feed'), {'since': cursor}, HTTP_ACCEPT='text/event-stream')
+        events = iter(response.streaming_content)
+        next(events)
+        event = next(events).decode()
+        response.close()
+        self.assertEqual(json.loads(event.partition('data: ')[2]), expected[0])
+
+class ChangeLogTransactionTests(TransactionTestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов ChangeLogTransactionTests")
+
+    def tearDown(self):
+        logger.info("Прерывание тестов ChangeLogTransactionTests")
+
+    def test_failed_change_rolls_back_save(self):
+        logger.info("Тестирование отката сохранения при ошибке записи в журнал изменений")
+        category = Category.objects.create(name="Test Category")
+        with mock.patch('backend.changes.write_changes', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            Product.objects.create(name="Test Product", category=category)
+        self.assertFalse(Product.objects.exists())
+
+class FastSerializationTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов FastSerializationTests")
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        category = Category.objects.create(name="Test Category")
+        for index in range(3):
+            shop = Shop.objects.create(name=f"Shop {index}", url=f"http://shop{index}.com")
+            category.shops.add(shop)
+            product = Product.objects.create(name=f"Product {index}", category=category)
+            ProductInfo.objects.create(product=product, shop=shop, external_id=index, name=product.name,
+                                       model="test", quantity=index, price="10.5", price_rrc="12")
+        order = Order.objects.create(user=self.user, state='new')
+        for product_info in ProductInfo.objects.all():
+            OrderItem.objects.create(order=order, product_info=product_info, quantity=2)
+        Order.objects.create(user=self.user, state='confirmed')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов FastSerializationTests")
+
+    def test_fast_lists_match_serializers(self):
+        logger.info("Тестирование совпадения быстрой и обычной сериализации")
+        for url in (reverse('productinfo-list'), reverse('order-list')):
+            regular = self.client.get(url)
+            with override_settings(FAST_LIST_SERIALIZATION=True):
+                fast = self.client.get(url)
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast.content, regular.content)
+
+    def test_orjson_renderer_matches_json_renderer(self):
+        logger.info("Тестирование совпадения ORJSONRenderer и JSONRenderer")
+        now = timezone.now()
+        data = {'dt': now, 'date': now.date(), 'time': now.time(), 'price': Decimal("10.50"),
+                'name': "Товар\u2028", 'items': [now, None], 'errors': {0: ["This field is required."]}}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_benchmark_command(self):
+        logger.info("Тестирование команды сравнения сериализаторов")
+        call_command('bench_serializers', rows=10, repeat=1, stdout=StringIO())
+
+
+class AdminTests(TestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов AdminTests")
+        self.user = User.objects.create_superuser(username='admin', password='testpass123')
+        category = Category.objects.create(name="Test Category")
+        self.shop = Shop.objects.create(name="Test Shop", url="http://testshop.com")
+        product = Product.objects.create(name="Test Product", category=category)
+        product_info = ProductInfo.objects.create(product=product, shop=self.shop, external_id=1, name=product.name,
+                                                  model="test", quantity=1, price=100, price_rrc=120)
+        order = Order.objects.create(user=self.user, state='new')
+        OrderItem.objects.create(order=order, product_info=product_info, quantity=1)
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов AdminTests")
+
+    def test_changelists(self):
+        logger.info("Тестирование списков административной панели")
+        for model in ('shop', 'category', 'product', 'productinfo', 'productparameter', 'order', 'orderitem'):
+            response = self.client.get(reverse(f'admin:backend_{model}_changelist'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_paginator_counts_exactly_on_small_tables(self):
+        logger.info("Тестирование подсчёта строк пагинатором")
+        offers = ProductInfo.objects.using(shard_for_shop(self.shop.id)).order_by('id')
+        paginator = EstimatedCountPaginator(offers, 100)
+        self.assertEqual(paginator.count, 1)
+
+class IdempotencyTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов IdempotencyTests")
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        category = Category.objects.create(name="Test Category")
+        shop = Shop.objects.create(name="Test Shop", url="http://testshop.com")
+        product = Product.objects.create(name="Test Product", category=category)
+        self.product_info = ProductInfo.objects.create(product=product, shop=shop, external_id=1, name=product.name,
+                                                       model="test", quantity=10, price=100, price_rrc=120)
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов IdempotencyTests")
+
+    def test_retry_is_replayed(self):
+        logger.info("Тестирование повтора запроса с ключом идемпотентности")
+        data = {'product_info': self.product_info.id, 'quantity': 2}
+        first = self.client.post(reverse('cart-list'), data, HTTP_IDEMPOTENCY_KEY='cart-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with mock.patch('backend.views.OrderItem.objects.update_or_create') as update_or_create:
+            retry = self.client.post(reverse('cart-list'), data, HTTP_IDEMPOTENCY_KEY='cart-1')
+        update_or_create.assert_not_called()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        checkout = self.client.post(reverse('order-list'), HTTP_IDEMPOTENCY_KEY='checkout-1')
+        retry = self.client.post(reverse('order-list'), HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(checkout.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.content, checkout.content)
+        self.assertEqual(Order.objects.filter(state='new').count(), 1)
+
+    def test_key_reused_for_other_request(self):
+        logger.info("Тестирование повторного использования ключа")
+        self.client.post(reverse('cart-list'), {'product_info': self.product_info.id, 'quantity': 2},
+                         HTTP_IDEMPOTENCY_KEY='cart-1')
+        response = self.client.post(reverse('cart-list'), {'product_info': self.product_info.id, 'quantity': 3},
+                                    HTTP_IDEMPOTENCY_KEY='cart-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_in_flight_duplicate(self):
+        logger.info("Тестирование одновременного повтора запроса")
+        IdempotencyKey.objects.create(user=self.user, key='checkout-1', request_hash='',
+                                      expires=timezone.now() + timedelta(minutes=1))
+        with mock.patch('backend.idempotency.request_fingerprint', return_value=''), \
+                mock.patch('backend.idempotency.WAIT_TIMEOUT', 0):
+            response = self.client.post(reverse('order-list'), HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_abandoned_claim_is_taken_over(self):
+        logger.info("Тестирование перехвата ключа, запрос которого не завершился")
+        claimed = timezone.now() - settings.IDEMPOTENCY_LEASE - timedelta(seconds=1)
+        IdempotencyKey.objects.create(user=self.user, key='checkout-1', request_hash='', claimed=claimed,
+                                      expires=timezone.now() + timedelta(minutes=1))
+        with mock.patch('backend.idempotency.request_fingerprint', return_value=''), \
+                mock.patch('backend.idempotency.WAIT_TIMEOUT', 0):
+            response = self.client.post(reverse('order-list'), HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(IdempotencyKey.objects.get(key='checkout-1').response_status, status.HTTP_400_BAD_REQUEST)
+
+class BatchTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов BatchTests")
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        category = Category.objects.create(name="Test Category")
+        self.shop = Shop.objects.create(name="Test Shop", url="http://testshop.com")
+        self.product_infos = []
+        for index in range(3):
+            product = Product.objects.create(name=f"Product {index}", category=category)
+            self.product_infos.append(ProductInfo.objects.create(product=product, shop=self.shop, external_id=index,
+                                                                 name=product.name, model="test", quantity=10,
+                                                                 price=100, price_rrc=120))
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов BatchTests")
+
+    def test_multi_get(self):
+        logger.info("Тестирование получения нескольких товаров одним запросом")
+        first, _, third = self.product_infos
+        with self.assertNumQueries(2, using=shard_for_shop(self.shop.id)):
+            response = self.client.get(reverse('productinfo-batch'), {'ids': f'{third.id},{first.id},999'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data], [third.id, first.id])
+
+    def test_batch_cart(self):
+        logger.info("Тестирование пакетного изменения корзины")
+        first, second, third = self.product_infos
+        cart = Order.objects.create(user=self.user, state='cart')
+        OrderItem.objects.create(order=cart, product_info=first, quantity=1)
+        OrderItem.objects.create(order=cart, product_info=second, quantity=1)
+
+        response = self.client.post(reverse('cart-batch'), {'items': [
+            {'product_info': first.id, 'quantity': 5},
+            {'product_info': second.id, 'quantity': 0},
+            {'product_info': third.id, 'quantity': 2},
+            {'product_info': 999, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['updated', 'deleted', 'created', 'error'])
+        self.assertEqual(dict(cart.ordered_items.values_list('product_info_id', 'quantity')),
+                         {first.id: 5, third.id: 2})
+
+    def test_one_cart_per_user(self):
+        logger.info("Тестирование единственной корзины пользователя")
+        cart = Order.objects.create(user=self.user, state='cart')
+        Order.objects.create(user=self.user, state='new')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user, state='cart')
+
+        response = self.client.post(reverse('cart-batch'), {'items': [
+            {'product_info': self.product_infos[0].id, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Order.objects.get(user=self.user, state='cart'), cart)
+
+@skipUnless(connection.features.has_select_for_update, "needs row locks")
+class CartBatchConcurrencyTests(TransactionTestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов CartBatchConcurrencyTests")
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        category = Category.objects.create(name="Test Category")
+        shop = Shop.objects.create(name="Test Shop", url="http://testshop.com")
+        product = Product.objects.create(name="Test Product", category=category)
+        self.product_info = ProductInfo.objects.create(product=product, shop=shop, external_id=1, name=product.name,
+                                                       model="test", quantity=10, price=100, price_rrc=120)
+        Order.objects.create(user=self.user, state='cart')
+
+    def tearDown(self):
+        logger.info("Прерывание тестов CartBatchConcurrencyTests")
+
+    def test_concurrent_batches_add_same_item(self):
+        logger.info("Тестирование одновременного добавления одного товара в корзину")
+        barrier = threading.Barrier(2)
+        statuses = []
+
+        def post(quantity):
+            client = APIClient(raise_request_exception=False)
+            client.force_authenticate(user=self.user)
+            barrier.wait()
+            try:
+                statuses.append(client.post(reverse('cart-batch'), {'items': [
+                    {'product_info': self.product_info.id, 'quantity': quantity},
+                ]}, format='json').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=post, args=(quantity,)) for quantity in (1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [status.HTTP_200_OK] * 2)
+        self.assertEqual(OrderItem.objects.filter(product_info=self.product_info).count(), 1)
+
+class ShopOrderTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов ShopOrderTests")
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.partner = User.objects.create_user(username='partner', password='testpass123')
+        category = Category.objects.create(name="Test Category")
+        self.shop = Shop.objects.create(name="Test Shop", url="http://testshop.com", user=self.partner)
+        other_shop = Shop.objects.create(name="Other Shop", url="http://othershop.com")
+        cart = Order.objects.create(user=self.user, state='cart')
+        for index, shop in enumerate((self.shop, self.shop, other_shop)):
+            product = Product.objects.create(name=f"Product {index}", category=category)
+            product_info = ProductInfo.objects.create(product=product, shop=shop, external_id=index,
+                                                      name=product.name, model="test", quantity=10,
+                                                      price=100, price_rrc=120)
+            OrderItem.objects.create(order=cart, product_info=product_info, quantity=index + 1)
+        self.client.force_authenticate(user=self.user)
+        self.order_id = self.client.post(reverse('order-list')).data['id']
+
+    def tearDown(self):
+        logger.info("Прерывание тестов ShopOrderTests")
+
+    def test_checkout_splits_order_by_shop(self):
+        logger.info("Тестирование разделения заказа по магазинам")
+        shop_order = ShopOrder.objects.get(order_id=self.order_id, shop=self.shop)
+        self.assertEqual(shop_order.state, 'new')
+        self.assertEqual(shop_order.item_count, 2)
+        self.assertEqual(shop_order.subtotal, 300)
+        self.assertEqual(ShopOrder.objects.filter(order_id=self.order_id).count(), 2)
+
+    def test_partner_inbox_and_state(self):
+        logger.info("Тестирование списка заказов партнёра")
+        self.client.force_authenticate(user=self.partner)
+        response = self.client.get(reverse('partner-order-list'), {'state': 'new'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+        response = self.client.post(reverse('partner-order-state', args=[response.data[0]['id']]),
+                                    {'state': 'confirmed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Order.objects.get(pk=self.order_id).state, 'new')
+
+        ShopOrder.objects.exclude(shop=self.shop).update(state='canceled')
+        self.client.post(reverse('partner-order-state', args=[response.data['id']]), {'state': 'sent'})
+        self.assertEqual(Order.objects.get(pk=self.order_id).state, 'sent')
+
+    def test_state_only_moves_forward(self):
+        logger.info("Тестирование допустимых переходов статуса заказа магазина")
+        self.client.force_authenticate(user=self.partner)
+        shop_order = ShopOrder.objects.get(order_id=self.order_id, shop=self.shop)
+        url = reverse('partner-order-state', args=[shop_order.id])
+        for state, expected in (('assembled', status.HTTP_200_OK), ('confirmed', status.HTTP_400_BAD_REQUEST),
+                                ('assembled', status.HTTP_400_BAD_REQUEST), ('sent', status.HTTP_200_OK),
+                                ('canceled', status.HTTP_400_BAD_REQUEST), ('delivered', status.HTTP_200_OK)):
+            response = self.client.post(url, {'state': state})
+            self.assertEqual(response.status_code, expected, state)
+        shop_order.refresh_from_db()
+        self.assertEqual(shop_order.state, 'delivered')
+
+        other = ShopOrder.objects.exclude(shop=self.shop).get(order_id=self.order_id)
+        other.shop.user = User.objects.create_user(username='other', password='testpass123')
+        other.shop.save()
+        self.client.force_authenticate(user=other.shop.user)
+        url = reverse('partner-order-state', args=[other.id])
+        self.assertEqual(self.client.post(url, {'state': 'canceled'}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(url, {'state': 'confirmed'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.get(pk=self.order_id).state, 'delivered')
+
+class ThrottlingTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов ThrottlingTests")
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов ThrottlingTests")
+        cache.clear()
+
+    def test_catalog_throttle(self):
+        logger.info("Тестирование ограничения частоты запросов к каталогу")
+        rest_framework = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'catalog': '2/min'})
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            responses = [self.client.get(reverse('product-list')) for _ in range(3)]
+        self.assertEqual([response.status_code for response in responses],
+                         [status.HTTP_200_OK, status.HTTP_200_OK, status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertIn('Retry-After', responses[-1])
+
+    @override_settings(LOAD_SHEDDING_MAX_IN_FLIGHT=1)
+    def test_load_shedding(self):
+        logger.info("Тестирование сброса нагрузки")
+        middleware = LoadSheddingMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get('/api/v1/product-info/')
+        self.assertEqual(middleware(request).status_code, status.HTTP_200_OK)
+        other_worker = LoadSheddingMiddleware(lambda request: HttpResponse())
+        other_worker.enter()
+        response = middleware(request)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(middleware(RequestFactory().get('/admin/')).status_code, status.HTTP_200_OK)
+        other_worker.leave()
+        self.assertEqual(middleware(request).status_code, status.HTTP_200_OK)
+
+        # The count of a worker that died mid-request expires with its key.
+        other_worker.enter()
+        cache.delete(other_worker.key)
+        self.assertEqual(middleware(request).status_code, status.HTTP_200_OK)
+
+    @override_settings(LOAD_SHEDDING_MAX_IN_FLIGHT=1)
+    def test_load_shedding_counts_only_running_views(self):
+        logger.info("Тестирование учета только выполняющихся представлений")
+        request = RequestFactory().get('/api/v1/changes/')
+        worker = LoadSheddingMiddleware(lambda request: StreamingHttpResponse(iter(['event'])))
+        other_worker = LoadSheddingMiddleware(lambda request: HttpResponse())
+        stream = worker(request)
+        self.assertEqual(other_worker(request).status_code, status.HTTP_200_OK)
+        stream.close()
+
+        def long_poll(request):
+            release_slot(request)
+            return HttpResponse(status=other_worker(request).status_code)
+
+        self.assertEqual(LoadSheddingMiddleware(long_poll)(request).status_code, status.HTTP_200_OK)
+        self.assertEqual(worker.in_flight, 0)
+
+@skipUnless({'shard1', 'shard2'} <= set(settings.DATABASES), "needs databases 'shard1' and 'shard2'")
+@override_settings(PRODUCT_SHARDS=['shard1', 'shard2'])
+class ShardingTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов ShardingTests")
+        cache.clear()
+        init_shard_sequences()
+        self.user = User.objects.create_user(username='partner', password='testpass123')
+        self.other_user = User.objects.create_user(username='other', password='testpass123')
+        self.category = Category.objects.create(name="Test Category")
+        self.product = Product.objects.create(name="Test Product", category=self.category)
+        self.shop_a = Shop.objects.create(name="Shop A", url="http://shopa.com", user=self.user)
+        self.shop_b = Shop.objects.create(name="Shop B", url="http://shopb.com", user=self.other_user)
+        pin_shop(self.shop_a.id, 'shard1')
+        pin_shop(self.shop_b.id, 'shard2')
+        import_shop(self.user, "Shop A", [("Test Product", self.category, 100)])
+        import_shop(self.other_user, "Shop B", [("Test Product", self.category, 90)])
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        logger.info("Прерывание тестов ShardingTests")
+        cache.clear()
+
+    def test_offers_live_on_shop_shard(self):
+        logger.info("Тестирование размещения предложений по шардам")
+        self.assertFalse(ProductInfo.objects.using('default').exists())
+        offer_a = ProductInfo.objects.using('shard1').get(shop=self.shop_a)
+        offer_b = ProductInfo.objects.using('shard2').get(shop=self.shop_b)
+        self.assertEqual(offer_a.id // SHARD_ID_SPAN, 1)
+        self.assertEqual(offer_b.id // SHARD_ID_SPAN, 2)
+        self.assertEqual(offer_a.product_parameters.get().value, "black")
+        self.assertIsNone(Shop.objects.using('shard1').get(pk=self.shop_a.pk).user_id)
+
+        summary = ProductOfferSummary.objects.get(product=self.product)
+        self.assertEqual((summary.shop, summary.offer_count), (self.shop_b, 2))
+
+    def test_fan_out_queries(self):
+        logger.info("Тестирование запросов по всем шардам")
+        response = self.client.get(reverse('productinfo-list'), {'product': self.product.id})
+        self.assertEqual([offer['shop']['name'] for offer in response.data], ["Shop B", "Shop A"])
+
+        ids = [offer['id'] for offer in response.data]
+        response = self.client.get(reverse('productinfo-batch'), {'ids': f'{ids[1]},{ids[0]}'})
+        self.assertEqual([offer['id'] for offer in response.data], [ids[1], ids[0]])
+        response = self.client.get(reverse('productinfo-detail', args=[ids[0]]))
+        self.assertEqual(response.data['shop']['name'], "Shop B")
+
+        response = self.client.post(reverse('cart-list'), {'product_info': ids[0], 'quantity': 2})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('order-list'))
+        self.assertEqual(response.data['total_sum'], 180)
+
+    def test_move_shop(self):
+        logger.info("Тестирование переноса магазина на другой шард")
+        old_id = ProductInfo.objects.using('shard1').get(shop=self.shop_a).id
+        cart = Order.objects.create(user=self.user, state='cart')
+        OrderItem.objects.create(order=cart, product_info_id=old_id, quantity=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('move_shop', self.shop_a.id, 'shard2', stdout=StringIO())
+        self.assertFalse(ProductInfo.objects.using('shard1').filter(shop=self.shop_a).exists())
+        self.assertFalse(ProductParameter.objects.using('shard1').exists())
+        offer = ProductInfo.objects.using('shard2').get(shop=self.shop_a)
+        self.assertEqual(offer.id // SHARD_ID_SPAN, 2)
+        self.assertEqual(offer.product_parameters.get().value, "black")
+        self.assertEqual(OrderItem.objects.get(order=cart).product_info_id, offer.id)
+        self.assertEqual(shard_for_shop(self.shop_a.id), 'shard2')
+
+    def test_move_shop_rerun_removes_leftovers(self):
+        logger.info("Тестирование повторного переноса магазина после прерывания")
+        offer = ProductInfo.objects.using('shard1').get(shop=self.shop_a)
+        parameter = offer.product_parameters.get()
+        call_command('move_shop', self.shop_a.id, 'shard2', stdout=StringIO())
+        # The source rows of an interrupted run are still there although the shop is pinned to the target.
+        ProductInfo.objects.using('shard1').bulk_create([offer])
+        ProductParameter.objects.using('shard1').bulk_create([parameter])
+
+        call_command('move_shop', self.shop_a.id, 'shard2', stdout=StringIO())
+        self.assertFalse(ProductInfo.objects.using('shard1').filter(shop=self.shop_a).exists())
+        self.assertEqual(ProductInfo.objects.using('shard2').filter(shop=self.shop_a).count(), 1)
+        response = self.client.get(reverse('productinfo-list'), {'product': self.product.id})
+        self.assertEqual([offer['shop']['name'] for offer in response.data], ["Shop B", "Shop A"])
+
+    def test_backfill_shards(self):
+        logger.info("Тестирование переноса справочников и предложений из основной базы на шарды")
+        user = User.objects.create_user(username='legacy', password='testpass123')
+        shop = Shop.objects.create(name="Shop C", url="http://shopc.com", user=user)
+        for alias in ('shard1', 'shard2'):
+            Shop.objects.using(alias).filter(pk=shop.pk).delete()
+        legacy = ProductInfo(product=self.product, shop=shop, external_id=1, name="Test Product", model="test",
+                             quantity=1, price=80, price_rrc=80)
+        legacy.save(using='default')
+        cart = Order.objects.create(user=self.user, state='cart')
+        OrderItem.objects.create(order=cart, product_info_id=legacy.id, quantity=1)
+
+        call_command('backfill_shards', stdout=StringIO())
+        self.assertIsNone(Shop.objects.using('shard1').get(pk=shop.pk).user_id)
+        self.assertTrue(Shop.objects.using('shard2').filter(pk=shop.pk).exists())
+        self.assertFalse(ProductInfo.objects.using('default').exists())
+        offer = ProductInfo.objects.using(shard_for_shop(shop.id)).get(shop=shop)
+        self.assertEqual(OrderItem.objects.get(order=cart).product_info_id, offer.id)
+
+    def test_shard_map_read_by_writers(self):
+        logger.info("Тестирование чтения карты шардов в обход устаревшего кэша")
+        ShopShard.objects.filter(shop=self.shop_a).update(database='shard2')
+        self.assertEqual(shard_for_shop(self.shop_a.id), 'shard1')
+        self.assertEqual(shard_for_shop(self.shop_a.id, cached=False), 'shard2')
+        self.assertEqual(shard_for_shop(self.shop_a.id), 'shard2')
+
+
+class SnapshotTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов снимков каталога")
+        self.root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(SNAPSHOT_ROOT=self.root.name, SNAPSHOT_ACCEL_REDIRECT='')
+        self.settings_override.enable()
+        self.user = User.objects.create_user(username='partner', password='testpass123')
+        self.category = Category.objects.create(name="Test Category")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop = import_shop(self.user, "Shop A", [("Shop A product", self.category, 100)])
+
+    def tearDown(self):
+        logger.info("Прерывание тестов снимков каталога")
+        self.settings_override.disable()
+        self.root.cleanup()
+
+    def get(self, scope, kind, **headers):
+        return self.client.get(reverse('catalog-snapshot', kwargs={'scope': scope, 'kind': kind}), headers=headers)
+
+    def test_snapshots_written_after_import(self):
+        logger.info("Тестирование снимков после импорта")
+        with self.captureOnCommitCallbacks(execute=True):
+            import_shop(User.objects.create_user(username='other', password='testpass123'), "Shop B",
+                        [("Shop B product", self.category, 90)])
+        self.assertEqual(self.get('all', 'json').status_code, status.HTTP_404_NOT_FOUND)
+        call_command('publish_snapshots', stale=True, stdout=StringIO())
+
+        with self.assertNumQueries(0):
+            response = self.get(self.shop.id, 'json', accept_encoding='gzip')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], f'"{read_manifest(self.shop.id)["json"]["sha256"]}"')
+        offers = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual([(offer['name'], offer['price'], offer['parameters']) for offer in offers],
+                         [("Shop A product", "100.00", {"Color": "black"})])
+
+        response = self.get('all', 'csv')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="catalog-all.csv.gz"')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('id,external_id,'))
+
+    def test_snapshots_ignore_credentials(self):
+        logger.info("Тестирование снимков с недействительным токеном")
+        response = self.get(self.shop.id, 'json', authorization='Bearer invalid')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="catalog-{self.shop.id}.json.gz"')
+
+    def test_inactive_and_deleted_shops_are_withdrawn(self):
+        logger.info("Тестирование удаления снимков отключенных и удаленных магазинов")
+        with self.captureOnCommitCallbacks(execute=True):
+            shop_b = import_shop(User.objects.create_user(username='other', password='testpass123'), "Shop B",
+                                 [("Shop B product", self.category, 90)])
+        call_command('publish_snapshots', stale=True, stdout=StringIO())
+
+        self.shop.state = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.save()
+        self.assertEqual(self.get(self.shop.id, 'json').status_code, status.HTTP_404_NOT_FOUND)
+        call_command('publish_snapshots', stale=True, stdout=StringIO())
+        response = self.get('all', 'json')
+        offers = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual([offer['name'] for offer in offers], ["Shop B product"])
+
+        self.shop.state = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.save()
+        self.assertEqual(self.get(self.shop.id, 'json').status_code, status.HTTP_200_OK)
+
+        shop_b_id = shop_b.id
+        with self.captureOnCommitCallbacks(execute=True):
+            shop_b.delete()
+        self.assertEqual(self.get(shop_b_id, 'json').status_code, status.HTTP_404_NOT_FOUND)
+        call_command('publish_snapshots', stale=True, stdout=StringIO())
+        response = self.get('all', 'json')
+        offers = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual([offer['name'] for offer in offers], ["Shop A product"])
+
+    def test_conditional_and_range_requests(self):
+        logger.info("Тестирование условных запросов и диапазонов")
+        response = self.get(self.shop.id, 'json')
+        content = b''.join(response.streaming_content)
+        etag = response['ETag']
+
+        self.assertEqual(self.get(self.shop.id, 'json', if_none_match=etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        response = self.get(self.shop.id, 'json', range='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(content)}')
+        self.assertEqual(b''.join(response.streaming_content), content[10:20])
+
+        response = self.get(self.shop.id, 'json', range='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), content[-5:])
+        response = self.get(self.shop.id, 'json', range='bytes=0-9', if_range='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get(self.shop.id, 'json', range=f'bytes={len(content)}-').status_code,
+                         status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(self.get(999, 'json').status_code, status.HTTP_404_NOT_FOUND)
+
+        with override_settings(SNAPSHOT_ACCEL_REDIRECT='/protected-snapshots/'):
+            response = self.get(self.shop.id, 'csv')
+        self.assertEqual(response['X-Accel-Redirect'],
+                         f'/protected-snapshots/{read_manifest(self.shop.id)["csv"]["path"]}')
+
+
+class CategoryShopTests(APITestCase):
+    databases = TEST_DATABASES
+
+    def setUp(self):
+        logger.info("Настройка тестов категорий магазинов")
+        cache.clear()
+        self.snapshot_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.snapshot_root.cleanup)
+        self.settings_override = override_settings(SNAPSHOT_ROOT=self.snapshot_root.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create_user(username='partner', password='testpass123')
+        self.phones = Category.objects.create(name="Phones")
+        self.tablets = Category.objects.create(name="Tablets")
+
+    def tearDown(self):
+        logger.info("Прерывание тестов категорий магазинов")
+        cache.clear()
+
+    def import_categories(self, categories):
+        with self.captureOnCommitCallbacks(execute=True):
+            return import_shop(self.user, "Partner Shop", [(f"Product {index}", category, 100)
+                                                           for index, category in enumerate(categories)])
+
+    def test_memberships_follow_offers(self):
+        logger.info("Тестирование пересчета категорий магазина при импорте")
+        shop = self.import_categories([self.phones, self.phones, self.tablets])
+        self.assertEqual(sorted(CategoryShop.objects.filter(shop=shop).values_list('category__name', 'offer_count')),
+                         [("Phones", 2), ("Tablets", 1)])
+
+        cursor = CatalogChange.objects.last().id
+        self.import_categories([self.phones])
+        self.assertEqual(list(CategoryShop.objects.filter(shop=shop).values_list('category__name', 'offer_count')),
+                         [("Phones", 1)])
+        change = CatalogChange.objects.get(id__gt=cursor, model='category')
+        self.assertEqual((change.object_id, change.data['shops']), (self.tablets.id, []))
+
+        response = self.client.get(reverse('category-list'))
+        self.assertEqual({category['name']: category['shops'] for category in response.data},
+                         {"Phones": [shop.id], "Tablets": []})
+
+    def test_shop_categories_cached(self):
+        logger.info("Тестирование кэшированного списка категорий магазина")
+        shop = self.import_categories([self.phones, self.tablets, self.tablets])
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('category-list'), {'shop': shop.id})
+        self.assertEqual(response.data, [{'id': self.tablets.id, 'name': "Tablets", 'offer_count': 2},
+                                         {'id': self.phones.id, 'name': "Phones", 'offer_count': 1}])
+
+        self.import_categories([self.phones])
+        response = self.client.get(reverse('category-list'), {'shop': shop.id})
+        self.assertEqual(response.data, [{'id': self.phones.id, 'name': "Phones", 'offer_count': 1}])
+        self.assertEqual(self.client.get(reverse('category-list'), {'shop': 'x'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_unknown_shop_is_not_cached(self):
+        logger.info("Тестирование запроса категорий несуществующего магазина")
+        response = self.client.get(reverse('category-list'), {'shop': 999})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(cache.get(shop_categories_key(999)))
@@ -0,0 +1,61 @@
+import time
+
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class ScopedBucketThrottle(BaseThrottle):
+    """
+    Per-scope request budget shared by all workers through the cache.
+
+    Views opt in with ``throttle_scope``; the rate comes from
+    ``DEFAULT_THROTTLE_RATES[scope]``. Clients are keyed by user (a partner
+    user owns exactly one shop, so this is also per shop) or by IP for
+    anonymous requests.
+
+    The bucket refills continuously: the request count of the previous window
+    is weighted by how much of it still overlaps the sliding window. Every
+    request costs one atomic ``incr`` and one ``get``, so the check is O(1)
+    and safe across processes with Redis or Memcached.
+    """
+    cache = cache
+    cache_format = 'throttle:{scope}:{ident}:{window}'
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+        if rate is None:
+            return True
+        num_requests, duration = self.parse_rate(rate)
+
+        ident = f'user-{request.user.pk}' if request.user.is_authenticated else f'ip-{self.get_ident(request)}'
+        now = time.time()
+        window, offset = divmod(now, duration)
+        key = self.cache_format.format(scope=scope, ident=ident, window=int(window))
+        previous_key = self.cache_format.format(scope=scope, ident=ident, window=int(window) - 1)
+
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            if self.cache.add(key, 1, duration * 2):
+                count = 1
+            else:
+                count = self.cache.incr(key)
+        previous = self.cache.get(previous_key, 0)
+
+        overlap = 1 - offset / duration
+        if previous * overlap + count <= num_requests:
+            return True
+        # The weighted previous window shrinks linearly until it leaves room for one more request.
+        excess = previous * overlap + count - num_requests
+        self.retry_after = min(duration - offset, excess / previous * duration) if previous else duration - offset
+        return False
+
+    def parse_rate(self, rate):
+        num, period = rate.split('/')
+        duration = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+        return int(num), duration
+
+    def wait(self):
+        return getattr(self, 'retry_after', None)
@@ -1,7 +1,6 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from . import views
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 router = DefaultRouter()
 router.register(r'shops', views.ShopViewSet)
@@ -11,12 +10,16 @@ router.register(r'product-info', views.ProductInfoViewSet)
 router.register(r'cart', views.CartViewSet, basename='cart')
 router.register(r'orders', views.OrderViewSet, basename='order')
 router.register(r'contacts', views.ContactViewSet, basename='contact')
+router.register(r'partner/orders', views.PartnerOrderViewSet, basename='partner-order')
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('register/', views.RegisterView.as_view(), name='register'),
+    path('register/', views.RegisterView.as_view(), name='user-register'),
     path('partner/update/', views.PartnerUpdate.as_view(), name='partner-update'),
+    path('changes/', views.ChangeFeed.as_view(), name='change-feed'),
+    re_path(r'^snapshots/(?P<scope>all|\d+)\.(?P<kind>json|csv)$', views.CatalogSnapshot.as_view(),
+            name='catalog-snapshot'),
     path('order/<int:order_id>/', views.OrderDetail.as_view(), name='order-detail'),
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/', views.TokenObtainView.as_view(), name='token_obtain_pair'),
+    path('token/refresh/', views.TokenRefresh.as_view(), name='token_refresh'),
 ]
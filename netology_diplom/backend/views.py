@@ -1,222 +1,559 @@
-import logging
-from django.test import TestCase
-from django.urls import reverse
-from rest_framework.test import APITestCase
-from rest_framework import status
-from django.contrib.auth import get_user_model
-from .models import Shop, Category, Product, Order, OrderItem, ProductInfo
-
-User = get_user_model()
-
-# Настройка логгера
-logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
-
-class ShopTests(TestCase):
-    def setUp(self):
-        logger.info("Настройка тестов покупок")
-        self.shop = Shop.objects.create(
-            name="Test Shop",
-            url="http://testshop.com"
-        )
-
-    def tearDown(self):
-        logger.info("Прерывание тестов покупок")
-
-    def test_shop_creation(self):
-        logger.info("Создание тестового магазина")
-        self.assertEqual(self.shop.name, "Test Shop")
-        self.assertEqual(self.shop.url, "http://testshop.com")
-
-class CategoryTests(TestCase):
-    def setUp(self):
-        logger.info("Настройка тестов категорий")
-        self.category = Category.objects.create(
-            name="Test Category"
-        )
-
-    def tearDown(self):
-        logger.info("Прерывание тестов категорий")
-
-    def test_category_creation(self):
-        logger.info("Тестирование создания категорий")
-        self.assertEqual(self.category.name, "Test Category")
-
-class ProductTests(TestCase):
-    def setUp(self):
-        logger.info("Настройка тестов товаров")
-        self.category = Category.objects.create(name="Test Category")
-        self.product = Product.objects.create(
-            name="Test Product",
-            category=self.category
-        )
-
-    def tearDown(self):
-        logger.info("Прерывание тестов товаров")
-
-    def test_product_creation(self):
-        logger.info("Тестирование создания товаров")
-        self.assertEqual(self.product.name, "Test Product")
-        self.assertEqual(self.product.category, self.category)
-
-class CartAPITests(APITestCase):
-    def setUp(self):
-        logger.info("Настройка API тестов корзины")
-        self.user = User.objects.create_user(
-            username='testuser',
-            password='testpass123'
-        )
-        self.category = Category.objects.create(name="Test Category")
-        self.product = Product.objects.create(
-            name="Test Product",
-            category=self.category,
-            price=100
-        )
-        self.client.force_authenticate(user=self.user)
-
-    def tearDown(self):
-        logger.info("Прерывание API тестов корзины")
-
-    def test_add_to_cart(self):
-        logger.info("Тестирование добавления в корзину")
-        url = reverse('cart-list')
-        data = {
-            'product': self.product.id,
-            'quantity': 2
-        }
-        response = self.client.post(url, data)
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(OrderItem.objects.count(), 1)
-        logger.info("Товар добавлен в корзину: %s", response.data)
-
-    def test_remove_from_cart(self):
-        logger.info("Тестирование удаления из корзины")
-        # Сначала добавляем товар в корзину
-        order = Order.objects.create(user=self.user, state='cart')
-        order_item = OrderItem.objects.create(
-            order=order,
-            product=self.product,
-            quantity=1,
-            price=self.product.price
-        )
-        
-        url = reverse('cart-detail', args=[order_item.id])
-        response = self.client.delete(url)
-        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        self.assertEqual(OrderItem.objects.count(), 0)
-        logger.info("Товар удален из корзины: %s", order_item)
-
-    def test_view_cart(self):
-        logger.info("Тестирование просмотра корзины")
-        url = reverse('cart-list')
-        response = self.client.get(url)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        logger.info("Корзина просмотрена: %s", response.data)
-
-class OrderAPITests(APITestCase):
-    def setUp(self):
-        logger.info("Настройка тестов OrderAPITests")
-        self.user = User.objects.create_user(
-            username='testuser',
-            password='testpass123'
-        )
-        self.category = Category.objects.create(name="Test Category")
-        self.product = Product.objects.create(
-            name="Test Product",
-            category=self.category,
-            price=100
-        )
-        self.client.force_authenticate(user=self.user)
-
-    def tearDown(self):
-        logger.info("Прерывание OrderAPITests")
-
-    def test_create_order(self):
-        logger.info("Тестирование создания заказа")
-        # Сначала добавляем товар в корзину
-        cart_order = Order.objects.create(user=self.user, state='cart')
-        OrderItem.objects.create(
-            order=cart_order,
-            product=self.product,
-            quantity=1,
-            price=self.product.price
-        )
-
-        url = reverse('order-list')
-        response = self.client.post(url)
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(Order.objects.filter(state='new').count(), 1)
-        logger.info("Заказ создан: %s", response.data)
-
-    def test_create_empty_order(self):
-        logger.info("Тестирование создания пустого заказа")
-        url = reverse('order-list')
-        response = self.client.post(url)
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        logger.info("Создание пустого заказа не удалось: %s", response.data)
-
-    def test_view_orders(self):
-        logger.info("Тестирование просмотра заказов")
-        url = reverse('order-list')
-        response = self.client.get(url)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        logger.info("Заказы просмотрены: %s", response.data)
-
-class AuthenticationTests(APITestCase):
-    def setUp(self):
-        logger.info("Настройка тестов аутентификации")
-        self.user_data = {
-            'username': 'testuser',
-            'password': 'testpass123',
-            'email': 'test@example.com'
-        }
-
-    def tearDown(self):
-        logger.info("Прерывание тестов аутентификации")
-
-    def test_user_registration(self):
-        logger.info("Тестирование регистрации пользователя")
-        url = reverse('user-register')
-        response = self.client.post(url, self.user_data)
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(User.objects.count(), 1)
-        logger.info("Пользователь зарегистрирован: %s", response.data)
-
-    def test_user_login(self):
-        logger.info("Тестирование входа пользователя")
-        # Сначала создаем пользователя
-        User.objects.create_user(**self.user_data)
-        
-        url = reverse('user-login')
-        response = self.client.post(url, {
-            'username': self.user_data['username'],
-            'password': self.user_data['password']
-        })
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('token', response.data)
-        logger.info("Пользователь вошел в систему: %s", response.data)
-
-class ProductInfoTests(TestCase):
-    def setUp(self):
-        logger.info("Настройка тестов ProductInfoTests")
-        self.shop = Shop.objects.create(name="Test Shop", url="http://testshop.com")
-        self.category = Category.objects.create(name="Test Category")
-        self.product = Product.objects.create(name="Test Product", category=self.category)
-        self.product_info = ProductInfo.objects.create(
-            product=self.product,
-            shop=self.shop,
-            quantity=10,
-            price=100,
-            price_rrc=120
-        )
-
-    def tearDown(self):
-        logger.info("Прерывание тестов ProductInfoTests")
-
-    def test_product_info_creation(self):
-        logger.info("Тестирование создания информации о товаре")
-        self.assertEqual(self.product_info.product, self.product)
-        self.assertEqual(self.product_info.shop, self.shop)
-        self.assertEqual(self.product_info.quantity, 10)
-        self.assertEqual(self.product_info.price, 100)
-        self.assertEqual(self.product_info.price_rrc, 120)
\ No newline at end of file
+import math
+import re
+import time
+from operator import attrgetter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.core.validators import URLValidator
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
+from django.core.exceptions import ValidationError
+from rest_framework import generics, mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.settings import api_settings
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .models import Shop, Category, Product, Order, OrderItem, ShopOrder, ProductInfo, CatalogChange, Contact
+from .middleware import release_slot
+from .renderers import EventStreamRenderer, ORJSONRenderer
+from .serializers import (ShopSerializer, CategorySerializer, ProductListSerializer, ProductInfoSerializer,
+                          OrderSerializer, OrderItemSerializer, ContactSerializer, RegisterSerializer,
+                          CartBatchSerializer, ShopOrderSerializer, ShopOrderStateSerializer)
+from .fulfillment import create_shop_orders, set_shop_order_state
+from .idempotency import idempotent
+from .sharding import (is_sharded, fan_out, shard_for_shop, db_for_product_info, group_by_database,
+                       product_info_values)
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .fast_serializers import serialize_product_infos, serialize_orders
+from .importer import fetch_price_list, import_shop_catalog
+from .snapshots import AGGREGATE, CONTENT_TYPES, open_snapshot
+from .categories import shop_categories
+
+
+class RegisterView(generics.CreateAPIView):
+    serializer_class = RegisterSerializer
+    permission_classes = [AllowAny]
+    throttle_scope = 'token'
+
+
+class ShopViewSet(viewsets.ReadOnlyModelViewSet):
+    throttle_scope = 'catalog'
+    queryset = Shop.objects.all()
+    serializer_class = ShopSerializer
+
+
+class ContactViewSet(viewsets.ModelViewSet):
+    serializer_class = ContactSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Contact.objects.filter(user=self.request.user).order_by('id')
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class BatchRetrieveMixin:
+    """``GET <list>/batch/?ids=1,2,3`` returns several objects from one query, in the requested order."""
+    MAX_BATCH_SIZE = 100
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request, *args, **kwargs):
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in request.query_params.get('ids', '').split(',') if pk))
+        except ValueError:
+            return Response({'Status': False, 'Error': 'ids must be a comma-separated list of integers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.MAX_BATCH_SIZE:
+            return Response({'Status': False, 'Error': f'No more than {self.MAX_BATCH_SIZE} ids per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        objects = {obj.pk: obj for obj in self.get_batch_objects(self.filter_queryset(self.get_queryset()), ids)}
+        found = [objects[pk] for pk in ids if pk in objects]
+        return Response(self.get_serializer(found, many=True).data)
+
+    def get_batch_objects(self, queryset, ids):
+        return queryset.filter(pk__in=ids)
+
+
+class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ``?shop=<id>`` lists the categories the shop sells in, with offer counts,
+    as of its last import (served from the cache).
+    """
+    throttle_scope = 'catalog'
+    queryset = Category.objects.prefetch_related(Prefetch('shops', queryset=Shop.objects.only('id')))
+    serializer_class = CategorySerializer
+
+    def list(self, request, *args, **kwargs):
+        shop = request.query_params.get('shop')
+        if shop is None:
+            return super().list(request, *args, **kwargs)
+        if not shop.isdigit():
+            raise ParseError('shop must be an integer')
+        categories = shop_categories(int(shop))
+        if categories is None:
+            raise NotFound('Shop not found')
+        return Response(categories)
+
+
+class ProductViewSet(BatchRetrieveMixin, viewsets.ReadOnlyModelViewSet):
+    throttle_scope = 'catalog'
+    queryset = (Product.objects
+                .select_related('category', 'offer_summary__shop')
+                .prefetch_related('category__shops'))
+    serializer_class = ProductListSerializer
+
+
+class FastListMixin:
+    """
+    Serve ``list`` from ``.values()`` rows when ``FAST_LIST_SERIALIZATION`` is on.
+
+    ``fast_serializer`` takes a queryset and returns the same data the
+    regular serializer would. Pagination, when configured, is applied to the
+    primary keys so the page itself is still fetched with ``.values()``.
+    """
+    fast_serializer = None
+
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_LIST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset.values_list('pk', flat=True))
+        if page is None:
+            return Response(self.fast_serializer(queryset))
+
+        rows = {row['id']: row for row in self.fast_serializer(queryset.filter(pk__in=page))}
+        return self.get_paginated_response([rows[pk] for pk in page])
+
+
+class ProductInfoViewSet(BatchRetrieveMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
+    throttle_scope = 'catalog'
+    queryset = (ProductInfo.objects
+                .select_related('product__category', 'shop')
+                .prefetch_related('product__category__shops')
+                .order_by('id'))
+    serializer_class = ProductInfoSerializer
+    fast_serializer = staticmethod(serialize_product_infos)
+
+    def get_queryset(self):
+        """
+        ``?product=`` lists the offers of one product cheapest first, ``?shop=``
+        the offers of one shop, ``?search=`` matches offer names.
+        """
+        queryset = super().get_queryset()
+        product = self.int_param('product')
+        if product is not None:
+            queryset = queryset.filter(product_id=product).order_by('price', 'id')
+        shop = self.int_param('shop')
+        if shop is not None:
+            queryset = queryset.filter(shop_id=shop)
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = queryset.filter(name__icontains=search)
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if pk is not None and str(pk).isdigit():
+            queryset = queryset.using(db_for_product_info(pk))
+        return queryset
+
+    def int_param(self, name):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ParseError(f'{name} must be an integer')
+
+    def list(self, request, *args, **kwargs):
+        if not is_sharded():
+            return super().list(request, *args, **kwargs)
+
+        shop = self.int_param('shop')
+        queryset = self.filter_queryset(self.get_queryset())
+        databases = [shard_for_shop(shop)] if shop is not None else None
+        objects = fan_out(queryset, databases, key=attrgetter(*queryset.query.order_by))
+        page = self.paginate_queryset(objects)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(objects, many=True).data)
+
+    def get_batch_objects(self, queryset, ids):
+        return fan_out(queryset.filter(pk__in=ids), list(group_by_database(ids)))
+
+
+class CartViewSet(viewsets.ModelViewSet):
+    serializer_class = OrderItemSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'cart'
+
+    def get_queryset(self):
+        return OrderItem.objects.filter(order__user=self.request.user, order__state='cart').order_by('id')
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            cart, _ = Order.objects.select_for_update().get_or_create(user=request.user, state='cart')
+            item, created = OrderItem.objects.update_or_create(
+                order=cart,
+                product_info=serializer.validated_data['product_info'],
+                defaults={'quantity': serializer.validated_data['quantity']})
+        return Response(self.get_serializer(item).data,
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    @idempotent
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @idempotent
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'])
+    @idempotent
+    def batch(self, request, *args, **kwargs):
+        """
+        Apply many cart changes in one transaction.
+
+        ``{"items": [{"product_info": 1, "quantity": 2}, ...]}`` adds or
+        updates items; quantity 0 removes the item. Responds with the outcome
+        of every item.
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        wanted = {item['product_info']: item['quantity'] for item in serializer.validated_data['items']}
+
+        results = {}
+        with transaction.atomic():
+            # Locking the cart serializes writers to it, so concurrent batches cannot both create the same item.
+            cart, _ = Order.objects.select_for_update().get_or_create(user=request.user, state='cart')
+            existing = {item.product_info_id: item for item in
+                        OrderItem.objects.select_for_update().filter(order=cart, product_info_id__in=wanted)}
+            known = {product_info_id for product_info_id, in product_info_values(wanted, 'id')}
+
+            to_create, to_update, to_delete = [], [], []
+            for product_info_id, quantity in wanted.items():
+                item = existing.get(product_info_id)
+                if product_info_id not in known:
+                    results[product_info_id] = {'status': 'error', 'error': 'Unknown product_info'}
+                elif quantity == 0:
+                    if item is not None:
+                        to_delete.append(item.id)
+                    results[product_info_id] = {'status': 'deleted' if item else 'unchanged'}
+                elif item is None:
+                    item = OrderItem(order=cart, product_info_id=product_info_id, quantity=quantity)
+                    to_create.append(item)
+                    results[product_info_id] = {'status': 'created', 'item': item}
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    to_update.append(item)
+                    results[product_info_id] = {'status': 'updated', 'item': item}
+                else:
+                    results[product_info_id] = {'status': 'unchanged', 'item': item}
+
+            OrderItem.objects.bulk_create(to_create)
+            OrderItem.objects.bulk_update(to_update, ['quantity'])
+            OrderItem.objects.filter(id__in=to_delete).delete()
+
+        response = []
+        for product_info_id, quantity in wanted.items():
+            result = results[product_info_id]
+            item = result.pop('item', None)
+            response.append({'product_info': product_info_id, 'quantity': quantity,
+                             'id': item.id if item else None, **result})
+        return Response({'results': response})
+
+
+class OrderViewSet(FastListMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = Order.objects.exclude(state='cart')
+    serializer_class = OrderSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'cart'
+    fast_serializer = staticmethod(serialize_orders)
+
+    @staticmethod
+    def with_items(queryset):
+        items = OrderItem.objects.order_by('id')
+        # Offers on shards cannot be joined; each item then loads its offer from its shard.
+        if not is_sharded():
+            items = items.select_related('product_info')
+        return queryset.prefetch_related(Prefetch('ordered_items', queryset=items))
+
+    def get_queryset(self):
+        return self.with_items(super().get_queryset().filter(user=self.request.user))
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        with transaction.atomic():
+            cart = Order.objects.select_for_update().filter(user=request.user, state='cart').first()
+            if cart is None or not cart.ordered_items.exists():
+                return Response({'Status': False, 'Error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+            cart.state = 'new'
+            cart.save(update_fields=['state'])
+            create_shop_orders(cart)
+        return Response(self.get_serializer(self.get_queryset().get(pk=cart.pk)).data,
+                        status=status.HTTP_201_CREATED)
+
+
+class OrderDetail(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'cart'
+
+    def get(self, request, order_id, *args, **kwargs):
+        queryset = OrderViewSet.with_items(Order.objects.exclude(state='cart').filter(user=request.user))
+        return Response(OrderSerializer(get_object_or_404(queryset, pk=order_id)).data)
+
+
+class PartnerOrderViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Sub-orders of the partner's shop, newest first.
+
+    ``?state=new`` filters by state; ``POST <id>/state/`` moves a sub-order to
+    a later state or cancels it (400 for any other change) and re-derives the
+    state of the parent order.
+    """
+    serializer_class = ShopOrderSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'partner'
+
+    def get_queryset(self):
+        queryset = ShopOrder.objects.filter(shop__user=self.request.user)
+        state = self.request.query_params.get('state')
+        if state:
+            queryset = queryset.filter(state=state)
+        return queryset
+
+    @action(detail=True, methods=['post'])
+    def state(self, request, *args, **kwargs):
+        shop_order = self.get_object()
+        serializer = ShopOrderStateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        set_shop_order_state(shop_order, serializer.validated_data['state'])
+        return Response(self.get_serializer(shop_order).data)
+
+
+class PartnerUpdate(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'import'
+
+    def post(self, request, *args, **kwargs):
+        url = request.data.get('url')
+        try:
+            URLValidator()(url)
+        except ValidationError as exc:
+            return Response({'Status': False, 'Error': exc.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            data = fetch_price_list(url)
+            import_shop_catalog(request.user, url, data)
+        except ValidationError as exc:
+            return Response({'Status': False, 'Error': exc.messages}, status=status.HTTP_400_BAD_REQUEST)
+        except (KeyError, TypeError) as exc:
+            return Response({'Status': False, 'Error': f'Malformed price list: {exc}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({'Status': True})
+
+
+class ChangeFeed(APIView):
+    """
+    Catalog changes after a cursor.
+
+    ``GET changes/?since=<id>&limit=<n>&wait=<seconds>`` long-polls until at
+    least one change is available or ``wait`` expires. With
+    ``Accept: text/event-stream`` the changes are streamed as Server-Sent
+    Events; reconnecting clients resume from ``Last-Event-ID``. Errors are
+    always rendered as JSON.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer]
+    throttle_scope = 'catalog'
+    # Events carry changes encoded exactly like the JSON responses.
+    event_renderer = ORJSONRenderer()
+
+    PAGE_SIZE = 500
+    MAX_PAGE_SIZE = 5000
+    MAX_WAIT = 30
+    POLL_INTERVAL = 0.5
+    STREAM_DURATION = 300
+    HEARTBEAT_INTERVAL = 15
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.query_params.get('since') or request.headers.get('Last-Event-ID') or 0)
+            limit = max(1, min(int(request.query_params.get('limit', self.PAGE_SIZE)), self.MAX_PAGE_SIZE))
+            wait = float(request.query_params.get('wait', 0))
+            if not math.isfinite(wait):
+                raise ValueError(wait)
+            wait = max(0, min(wait, self.MAX_WAIT))
+        except ValueError:
+            return Response({'Status': False, 'Error': 'since, limit and wait must be numbers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if request.accepted_renderer.format == 'sse':
+            response = StreamingHttpResponse(self.stream(since, limit), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        changes = self.poll(request, since, limit, wait)
+        cursor = changes[-1]['id'] if changes else since
+        return Response({'cursor': cursor, 'changes': changes})
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if isinstance(response, Response) and response.accepted_renderer.format == 'sse':
+            # Only the stream itself is an event stream; errors (400, 401, 429) are rendered as JSON.
+            response.accepted_renderer = self.event_renderer
+            response.accepted_media_type = self.event_renderer.media_type
+        return response
+
+    def fetch(self, since, limit):
+        return list(CatalogChange.objects.filter(id__gt=since)
+                    .values('id', 'model', 'object_id', 'action', 'data', 'created')[:limit])
+
+    def poll(self, request, since, limit, wait):
+        deadline = time.monotonic() + wait
+        while True:
+            changes = self.fetch(since, limit)
+            if changes or time.monotonic() >= deadline:
+                return changes
+            # Waiting for changes does not count against the load-shedding limit.
+            release_slot(request)
+            time.sleep(self.POLL_INTERVAL)
+
+    def stream(self, since, limit):
+        deadline = time.monotonic() + self.STREAM_DURATION
+        last_sent = time.monotonic()
+        yield 'retry: 1000\n\n'
+        while time.monotonic() < deadline:
+            changes = self.fetch(since, limit)
+            for change in changes:
+                since = change['id']
+                yield f"id: {since}\nevent: change\ndata: {self.event_renderer.render(change).decode()}\n\n"
+            if changes:
+                last_sent = time.monotonic()
+                continue
+            if time.monotonic() - last_sent >= self.HEARTBEAT_INTERVAL:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(self.POLL_INTERVAL)
+
+
+class SnapshotNegotiation(BaseContentNegotiation):
+    """Snapshots are a single representation; errors are always rendered as JSON."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class CatalogSnapshot(APIView):
+    """
+    The prebuilt catalog of one shop or of all active shops.
+
+    ``GET snapshots/<shop id>.json``, ``snapshots/all.csv``, ... serve the
+    gzip file written by the last import straight from disk (or through
+    nginx when ``SNAPSHOT_ACCEL_REDIRECT`` is set). Clients accepting gzip
+    get it with ``Content-Encoding: gzip``, others as an ``application/gzip``
+    download. The ETag is the sha256 of the file; ``If-None-Match`` and
+    single ``Range`` requests are supported.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    content_negotiation_class = SnapshotNegotiation
+    throttle_scope = 'catalog'
+
+    RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+    CHUNK_SIZE = 64 * 1024
+
+    def get(self, request, scope, kind):
+        file, entry = open_snapshot(scope if scope == AGGREGATE else int(scope), kind)
+        if file is None:
+            return Response({'Status': False, 'Error': 'Snapshot not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{entry["sha256"]}"'
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Accept-Ranges': 'bytes', 'Vary': 'Accept-Encoding'}
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            content_type = CONTENT_TYPES[kind]
+            headers['Content-Encoding'] = 'gzip'
+            download = {}
+        else:
+            content_type = 'application/gzip'
+            download = {'as_attachment': True, 'filename': f'catalog-{scope}.{kind}.gz'}
+            headers['Content-Disposition'] = f'attachment; filename="{download["filename"]}"'
+
+        if any(tag in (etag, f'W/{etag}', '*') for tag in parse_etags(request.headers.get('If-None-Match', ''))):
+            file.close()
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if settings.SNAPSHOT_ACCEL_REDIRECT:
+            file.close()
+            headers['X-Accel-Redirect'] = f"{settings.SNAPSHOT_ACCEL_REDIRECT.rstrip('/')}/{entry['path']}"
+            return HttpResponse(content_type=content_type, headers=headers)
+
+        byte_range = self.parse_range(request, etag, entry['size'])
+        if byte_range is None:
+            return FileResponse(file, content_type=content_type, headers=headers, **download)
+        if byte_range is False:
+            file.close()
+            headers['Content-Range'] = f"bytes */{entry['size']}"
+            return HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+
+        start, end = byte_range
+        headers['Content-Range'] = f"bytes {start}-{end}/{entry['size']}"
+        headers['Content-Length'] = end - start + 1
+        response = StreamingHttpResponse(self.read_range(file, start, end - start + 1),
+                                         status=status.HTTP_206_PARTIAL_CONTENT,
+                                         content_type=content_type, headers=headers)
+        response._resource_closers.append(file.close)
+        return response
+
+    def parse_range(self, request, etag, size):
+        """
+        ``(start, end)`` of a satisfiable single range, ``False`` if it cannot be
+        satisfied, ``None`` to serve the whole file (no range, multiple ranges,
+        or an ``If-Range`` that no longer matches).
+        """
+        match = self.RANGE_RE.match(request.headers.get('Range', ''))
+        if not match or request.headers.get('If-Range', etag) != etag:
+            return None
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        elif last:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            return None
+        if start >= size or start > end:
+            return False
+        return start, end
+
+    def read_range(self, file, start, length):
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(self.CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class TokenObtainView(TokenObtainPairView):
+    throttle_scope = 'token'
+
+
+class TokenRefresh(TokenRefreshView):
+    throttle_scope = 'token'
@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'backend.middleware.LoadSheddingMiddleware',
+    'backend.middleware.EventStreamGZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -93,19 +95,74 @@ DATABASES = {
     }
 }
 
+# Optional sharding of offers by shop (see backend/sharding.py): PRODUCT_SHARDS=shard1,shard2.
+# Each shard is configured with <ALIAS>_POSTGRES_* variables, falling back to the default database's.
+PRODUCT_SHARDS = [alias for alias in os.getenv('PRODUCT_SHARDS', '').split(',') if alias]
+for alias in PRODUCT_SHARDS:
+    prefix = f'{alias.upper()}_POSTGRES_'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv(prefix + 'DB', f"{os.getenv('POSTGRES_DB')}_{alias}"),
+        'USER': os.getenv(prefix + 'USER', os.getenv('POSTGRES_USER')),
+        'PASSWORD': os.getenv(prefix + 'PASSWORD', os.getenv('POSTGRES_PASSWORD')),
+        'HOST': os.getenv(prefix + 'HOST', os.getenv('POSTGRES_HOST')),
+        'PORT': os.getenv(prefix + 'PORT', os.getenv('POSTGRES_PORT')),
+    }
+DATABASE_ROUTERS = ['backend.sharding.ShopShardRouter']
+
+# Cache shared by all workers (throttle counters); local memory when REDIS_URL is not set
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Load shedding: limit of in-flight API requests across all workers, counted in the cache (0 disables it)
+LOAD_SHEDDING_MAX_IN_FLIGHT = int(os.getenv('LOAD_SHEDDING_MAX_IN_FLIGHT', 50))
+LOAD_SHEDDING_PATHS = ['/api/']
+LOAD_SHEDDING_RETRY_AFTER = 1
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_THROTTLE_CLASSES': [
+        'backend.throttling.ScopedBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'catalog': '600/min',
+        'cart': '120/min',
+        'partner': '120/min',
+        'import': '10/hour',
+        'token': '20/min',
+    },
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# Serve product-info/ and orders/ lists from values() rows (see backend/fast_serializers.py)
+FAST_LIST_SERIALIZATION = os.getenv('FAST_LIST_SERIALIZATION', 'false').lower() in ('1', 'true', 'yes')
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
 
+# Responses to requests with an Idempotency-Key header are replayed to retries for this long
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# A key still in progress this long after it was claimed is taken over by a retry (its worker is presumed dead)
+IDEMPOTENCY_LEASE = timedelta(seconds=60)
+
+# Catalog snapshots written after each import (see backend/snapshots.py). With
+# SNAPSHOT_ACCEL_REDIRECT set to an nginx internal location aliased to
+# SNAPSHOT_ROOT, the files are handed to nginx instead of being sent by Django.
+SNAPSHOT_ROOT = os.getenv('SNAPSHOT_ROOT', BASE_DIR / 'snapshots')
+SNAPSHOT_ACCEL_REDIRECT = os.getenv('SNAPSHOT_ACCEL_REDIRECT', '')
+
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')